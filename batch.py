@@ -0,0 +1,185 @@
+"""
+batch module
+   Solve many puzzles in one process pool, writing one JSON record
+   per puzzle.
+
+2015 Bryan Clair
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import branching
+import nurikabe
+import solver
+import stats
+
+def _cpu():
+    """Return CPU time used by this process."""
+    t = os.times()
+    return t[0] + t[1]
+
+def puzzle_files(paths):
+    """Return list of puzzle files named by paths.  A directory stands
+    for all the .txt files in it."""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files.extend(sorted(glob.glob(os.path.join(p,'*.txt'))))
+        else:
+            files.append(p)
+    return files
+
+def solve_file(path,*args,**kwargs):
+    """Solve the puzzle in a file, returning a record of the result as
+    solve_layout, with the name and path of the file."""
+    try:
+        with open(path) as f:
+            layout = f.read()
+    except IOError as e:
+        record = _record()
+        record['status'] = 'error'
+        record['error'] = str(e)
+        record['wall'] = record['cpu'] = 0.0
+    else:
+        record = solve_layout(layout,*args,**kwargs)
+    record['name'] = os.path.basename(path)
+    record['path'] = path
+    return record
+
+def _record():
+    """Return a record of a puzzle not yet solved."""
+    return {'solutions':0, 'grids':[], 'nodes':0, 'backtracks':0,
+            'connectivity_checks':0, 'island_explorations':0,
+            'complete':False}
+
+def solve_layout(layout,maxvars=9,limit=None,timeout=None,timing=False,
+                 branch='reach',values='water',node_limit=None,
+                 restarts=None,seed=None,cache=None,engine='cells',
+                 probe=False,watch=None):
+    """Solve a puzzle, returning a record of the result.
+    The status is 'solved', 'unsolvable', 'unknown' (if the search ran
+    out of time or nodes before finding a solution), 'cancelled' (if
+    it was paused first) or 'error'.
+    Solutions are given in compact form, as a list of rows.
+    With timing, the record also holds the full search statistics.
+    branch and values name the branching strategy and value order,
+    and restarts and seed are as for Solver.iter_solutions.
+    If a cache.Cache is given, solutions are looked up there first, and
+    saved there after a search.  engine names the board class, one of
+    board.ENGINES, and probe turns on failed literal probing (see
+    propagate.Propagator.probe_rule).  If watch is given, it is called
+    with the Solver before the search starts, e.g. to pause it later."""
+    record = _record()
+    wall = time.time()
+    cpu = _cpu()
+    try:
+        b = nurikabe.parse_board(layout,engine=engine)
+        record['width'] = b.width
+        record['height'] = b.height
+        for letter in b.domains:
+            b.narrow_variable(letter,1,maxvars)
+
+        found = cache and cache.lookup(layout,maxvars,limit)
+        if found:
+            (cached,complete) = found
+            record['grids'] = [sol.replace(' ','').split('\n')
+                               for sol in cached[:limit]]
+            record['complete'] = complete and \
+                (limit is None or len(cached) < limit)
+            if cached:
+                record['status'] = 'solved'
+            else:
+                record['status'] = 'unsolvable'
+            record['cached'] = True
+            return _finish(record,wall,cpu)
+
+        st = stats.Stats(timing)
+        s = solver.Solver(b,st,branching.brancher(branch,values),probe)
+        s.timeout = timeout
+        s.max_nodes = node_limit
+
+        if watch:
+            watch(s)
+        solutions = []
+        for sol in s.iter_solutions(restarts=restarts,seed=seed):
+            solutions.append(sol)
+            record['grids'].append(sol.replace(' ','').split('\n'))
+            if len(record['grids']) == limit:
+                break
+        record['complete'] = s.status == 'complete'
+        if record['grids']:
+            record['status'] = 'solved'
+        elif record['complete']:
+            record['status'] = 'unsolvable'
+        elif s.status == 'paused':
+            record['status'] = 'cancelled'
+        else:
+            record['status'] = 'unknown'
+        record['nodes'] = st.nodes
+        record['backtracks'] = st.backtracks
+        record['connectivity_checks'] = b.connectivity_checks
+        record['island_explorations'] = b.island_explorations
+        if timing:
+            record['stats'] = st.as_dict()
+        if cache and (record['grids'] or record['complete']):
+            cache.store(layout,maxvars,solutions,record['complete'],
+                        {'seconds':round(time.time() - wall,6),
+                         'nodes':st.nodes,'backtracks':st.backtracks})
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e) or e.__class__.__name__
+        record['traceback'] = traceback.format_exc()
+
+    return _finish(record,wall,cpu)
+
+def _finish(record,wall,cpu):
+    """Fill in the counts and times of a record, and return it."""
+    record['solutions'] = len(record['grids'])
+    record['wall'] = round(time.time() - wall,6)
+    record['cpu'] = round(_cpu() - cpu,6)
+    return record
+
+def _solve_args(args):
+    return solve_file(*args)
+
+def run(paths,out=sys.stdout,jobs=1,maxvars=9,limit=None,timeout=None,
+        timing=False,branch='reach',values='water',node_limit=None,
+        restarts=None,seed=None,cache=None,engine='cells',probe=False):
+    """Solve all the puzzles named by paths with jobs processes, writing
+    a JSON record for each to out as it finishes.
+    Return a dictionary counting puzzles by status."""
+    work = [(f,maxvars,limit,timeout,timing,branch,values,node_limit,
+             restarts,seed,cache,engine,probe) for f in puzzle_files(paths)]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        records = pool.imap_unordered(_solve_args,work)
+    else:
+        pool = None
+        records = (_solve_args(w) for w in work)
+
+    counts = {}
+    try:
+        for record in records:
+            out.write(json.dumps(record,sort_keys=True)+'\n')
+            out.flush()
+            counts[record['status']] = counts.get(record['status'],0) + 1
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    return counts
+
+if __name__ == '__main__':
+    import pprint
+    start = time.time()
+    counts = run(sys.argv[1:] or ['examples'],out=open(os.devnull,'w'),jobs=2)
+    pprint.pprint(counts)
+    print time.time()-start,'elapsed.'
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+"""
+Nurikabe solver benchmark
+2015 Bryan Clair
+
+Runs the puzzles of the benchmark corpus, reporting time and work
+counters for each.  Results can be saved as a JSON baseline, and a
+run can be compared against a saved baseline: puzzles that got slower
+by more than the threshold, or whose solution count changed, are
+reported and make the exit status nonzero.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import batch
+import board
+import branching
+
+# version of the baseline file format
+FORMAT = 1
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),'examples')
+
+# puzzle files of the corpus, by tier
+CORPUS = [
+    ('easy',   ['easy0.txt', 'easy1.txt', 'easy2.txt', 'example.txt']),
+    ('medium', ['medium0.txt', 'medium1.txt', 'medium2.txt', 'medium3.txt',
+                'medium4.txt', 'janko42.txt', 'momotereu.txt', 'ones.txt']),
+    ('hard',   ['hard0.txt', 'hard1.txt']),
+    ('lgo',    ['lgo-2009-07-19.txt', 'lgo-2010-10-25.txt',
+                'lgo-2012-10-10.txt', 'lgo-2014-11-28.txt']),
+    ('crypto', ['crypto0.txt', 'crypto1.txt', 'crypto2.txt']),
+    ]
+
+# counters copied from the batch record of the last repetition
+COUNTERS = ['solutions', 'nodes', 'backtracks',
+            'connectivity_checks', 'island_explorations']
+
+# times below this many seconds are too noisy to compare
+NOISE = 0.01
+
+def revision():
+    """Return the git revision of the solver, or None."""
+    try:
+        with open(os.devnull,'w') as null:
+            return subprocess.check_output(
+                ['git','describe','--always','--dirty'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=null).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run(tiers=None,repeat=3,timeout=None,out=sys.stdout,
+        branch='reach',values='water',engine='cells',probe=False):
+    """Benchmark the corpus, or only the given tiers.
+    Each puzzle is solved repeat times, and the median time reported.
+    branch and values name the branching strategy and value order,
+    engine the board class, and probe turns on failed literal probing.
+    Return the results, ready to save as a baseline."""
+    results = {'format':FORMAT, 'revision':revision(),
+               'python':platform.python_version(),
+               'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+               'repeat':repeat, 'timeout':timeout,
+               'branch':branch, 'values':values, 'engine':engine,
+               'probe':probe,
+               'puzzles':{}}
+    for (tier,files) in CORPUS:
+        if tiers and tier not in tiers:
+            continue
+        for name in files:
+            times = []
+            for r in range(repeat):
+                record = batch.solve_file(os.path.join(EXAMPLES,name),
+                                          timeout=timeout,branch=branch,
+                                          values=values,engine=engine,
+                                          probe=probe)
+                times.append(record['wall'])
+                if record['status'] in ('unknown','error'):
+                    break
+            times.sort()
+            entry = {'tier':tier, 'status':record['status'],
+                     'time':times[len(times)//2], 'best':times[0]}
+            for c in COUNTERS:
+                entry[c] = record[c]
+            results['puzzles'][name] = entry
+            out.write('%-7s %-20s %-10s %8.3f %8d nodes\n' %
+                      (tier, name, entry['status'], entry['time'],
+                       entry['nodes']))
+            out.flush()
+    return results
+
+def compare(results,baseline,threshold=1.2,out=sys.stdout):
+    """Compare results with a baseline.  Report puzzles more than
+    threshold times slower, or with a different number of solutions.
+    Return the number of regressions."""
+    regressions = 0
+    for (name,new) in sorted(results['puzzles'].items()):
+        old = baseline['puzzles'].get(name)
+        if old is None:
+            continue
+        note = ''
+        if new['status'] != old['status'] or \
+                new['solutions'] != old['solutions']:
+            note = 'CHANGED %s/%d -> %s/%d' % (old['status'],old['solutions'],
+                                               new['status'],new['solutions'])
+        elif max(new['time'],old['time']) < NOISE:
+            continue
+        elif new['time'] > threshold * max(old['time'],NOISE):
+            note = 'SLOWER'
+        ratio = new['time'] / max(old['time'],NOISE)
+        out.write('%-20s %8.3f %8.3f %6.2fx %s\n' %
+                  (name, old['time'], new['time'], ratio, note))
+        if note:
+            regressions += 1
+    return regressions
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Times to solve each puzzle.")
+    parser.add_argument('-t', '--timeout', type=float, default=60,
+                        help="Seconds allowed for each puzzle.")
+    parser.add_argument('--tiers', default='',
+                        help="Comma separated tiers to run: " +
+                        ','.join([t for (t,f) in CORPUS]))
+    parser.add_argument('--branch', choices=sorted(branching.STRATEGIES),
+                        default='reach',
+                        help="Branching strategy to benchmark.")
+    parser.add_argument('--values', choices=sorted(branching.VALUES),
+                        default='water',
+                        help="Value order to benchmark.")
+    parser.add_argument('--engine', choices=sorted(board.ENGINES),
+                        default='cells',
+                        help="Board engine to benchmark.")
+    parser.add_argument('--probe', action='store_true',
+                        help="Benchmark with failed literal probing.")
+    parser.add_argument('-s', '--save', type=argparse.FileType('w'),
+                        help="Save results as a baseline.")
+    parser.add_argument('-c', '--compare', type=argparse.FileType('r'),
+                        help="Compare results with a saved baseline.")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Slowdown factor counted as a regression.")
+    args = parser.parse_args()
+
+    tiers = [t for t in args.tiers.split(',') if t]
+    results = run(tiers,args.repeat,args.timeout,
+                  branch=args.branch,values=args.values,engine=args.engine,
+                  probe=args.probe)
+    if args.save:
+        json.dump(results,args.save,indent=1,sort_keys=True,
+                  separators=(',',': '))
+        args.save.write('\n')
+    if args.compare:
+        baseline = json.load(args.compare)
+        if baseline.get('format') != FORMAT:
+            sys.exit('Baseline has format %s, not %d.' %
+                     (baseline.get('format'),FORMAT))
+        print
+        print 'Compared with baseline from', baseline.get('revision'), \
+            baseline.get('date'), 'using', baseline.get('branch','reach'), \
+            baseline.get('values','water'), baseline.get('engine','cells'), \
+            'probing' if baseline.get('probe') else ''
+        regressions = compare(results,baseline,args.threshold)
+        print regressions,'regressions.'
+        if regressions:
+            sys.exit(1)
@@ -6,72 +6,242 @@ board module
 2015 Bryan Clair
 """
 
-import networkx as nx
 import graphutil
 import logging
+import random
+from array import array
+from collections import deque
 from squares import *
 
+# trail entries
+_FRONTIER_ADD = 0
+_UNION = 1
+_REACH = 2
+_DOMAIN = 3
+_SCAN = 4
+
+# seed for the Zobrist keys, fixed so every process hashes alike
+_ZOBRIST_SEED = 2015
+
 class Board:
-    """Store a Nurikabe board."""
+    """Store a Nurikabe board, on any graph with the networkx interface.
+
+    Nodes of the graph are mapped to integer indices once, at construction.
+    All cell state lives in flat arrays indexed that way:
+      state     bytearray of EMPTY/WATER/LAND codes
+      size      anchor size at each index, 0 if not an anchor
+      variables variable island letter for variable-size anchors
+      nbrs      tuple of neighbor indices for each index
+
+    A variable island size is named by a letter, and all anchors with
+    the same letter have the same size.  The board keeps the range of
+    sizes each letter could still have in domains, and the solver
+    narrows it as the search goes (see narrow_variable).
+
+    Islands are kept in a registry, updated as nodes are filled and
+    restored by pop_move.  Every Land node belongs to an island in a
+    union-find forest (union by size, no path compression so unions
+    can be undone).  Each island root records the island size, its
+    anchors and its frontier of adjacent Empty nodes, and the nodes of
+    each island are linked in a circular list.
+
+    For each anchor, the board also knows which nodes its island could
+    still grow into (see anchor_reach), and which Empty nodes next to it
+    are forced (see island_forced).  These are computed on demand, and
+    a move only discards the ones it could have changed.
+
+    zhash is a Zobrist hash of state, kept current as nodes change:
+    the xor of zkeys[i][code] over all indices i.
+    """
     def __init__(self,g):
         """Initialize with any graph."""
         self.graph = g
 
+        # integer indexing of nodes and neighbor table
+        self.nodes = list(g)
+        self.index = dict((n,i) for (i,n) in enumerate(self.nodes))
+        self.nbrs = [tuple([self.index[m] for m in g[n]]) for n in self.nodes]
+
         # Fill with emptiness.
-        for n in self.graph:
-            self.graph.node[n]['val'] = Empty()
+        self.state = bytearray(len(self.nodes))
+        self.size = array('i',[0]*len(self.nodes))
+        self.variables = {}
+        self.domains = {}   # letter -> (lo,hi) range of variable size
+
+        # random key for each code at each index, 0 for EMPTY
+        rand = random.Random(_ZOBRIST_SEED)
+        self.zkeys = [(0,int(rand.getrandbits(63)),int(rand.getrandbits(63)))
+                      for n in self.nodes]
+        self.zhash = 0
 
-        # track anchors and largest anchor (to limit un-anchored islands)
+        # track anchors and largest fixed anchor (to limit un-anchored islands)
         self.anchors = []
         self.anchor_maxsize = 0
 
         # pools are defined as water cycles of minimum length
         # find all the pools in the graph, indexed by nodes
-        (self.pool_size,self.pools) = graphutil.find_shortest_cycles(g)
+        (self.pool_size,self.pools) = self._shortest_cycles()
+
+        # Each pool once, as a tuple of indices, with the pools each
+        # index is in and a count of the water in each pool.  Pools one
+        # node short of all water are kept in a set.
+        number = {}
+        for n in self.nodes:
+            for p in self.pools[n]:
+                number.setdefault(p,len(number))
+        self.pool_list = [None]*len(number)
+        for (p,k) in number.items():
+            self.pool_list[k] = tuple([self.index[n] for n in p])
+        self.node_pools = [tuple([number[p] for p in self.pools[n]])
+                           for n in self.nodes]
+        self.pool_water = array('i',[0]*len(number))
+        self.pools_one_short = set()
 
         # keep track as well as possible whether water could be connected.
         # True: possible to connect water using more water
         # False: impossible to connect water
         # None: State unknown
+        # Once known, filling empty nodes keeps the status current.
         self.water_connected = None
+        self.waters = 0     # count of Water nodes
+
+        # work counters, for benchmarking
+        self.connectivity_checks = 0
+        self.island_explorations = 0
+
+        # island registry, meaningful at Land nodes (and roots) only
+        n = len(self.nodes)
+        self.isle_parent = array('i',range(n))
+        self.isle_next = array('i',range(n))
+        self.isle_size = array('i',[0]*n)
+        self.isle_anchors = [None]*n
+        self.isle_frontier = [None]*n
+
+        # anchor index -> nodes its island could grow into, and
+        # anchor index -> nodes looked at while finding them
+        self.reach = {}
+        self.reach_seen = {}
+        self.cut_memo = {}  # anchor index -> last island_cuts of its reach
+
+        # anchor index -> nodes its island forces, and
+        # index -> anchors that looked at it while finding them
+        self.scan = {}
+        self.scan_watch = {}
 
         # A move stack so moves can be pushed and popped
         # All variable state should be saved on the stack.
-        # At the moment, this is only the water_connected status.
+        # Each entry holds the old value of the node, the water_connected
+        # status and the height of the trail, which logs the changes
+        # made to the island registry and to anchor reach.
         self.movestack = []
+        self.trail = []
 
     def __str__(self):
         return str(self.graph)
 
-    def _set_node(self,node,val):
-        """Set the node to val without considering other state."""
-        self.graph.node[node]['val'] = val
-        
+    def start_node(self):
+        """Return the node to start traversals of the board from."""
+        return self.nodes[0]
+
+    def _shortest_cycles(self):
+        """Return the girth of the graph and the shortest cycles at each
+        node, as graphutil.find_shortest_cycles."""
+        return graphutil.find_shortest_cycles(self.graph)
+
+    def _square(self,i):
+        """Return a Square describing the node at index i."""
+        code = self.state[i]
+        if code == LAND:
+            if i in self.variables:
+                letter = self.variables[i]
+                (lo,hi) = self.domains[letter]
+                if lo == hi:
+                    return Anchor(lo)
+                return Anchor(letter,lo,hi)
+            if self.size[i]:
+                return Anchor(self.size[i])
+            return Land()
+        if code == WATER:
+            return Water()
+        return Empty()
+
+    def _set_node(self,i,code,size=0):
+        """Set the node at index i without considering other state."""
+        if self.state[i] == WATER:
+            self.waters -= 1
+            self._count_pool_water(i,-1)
+        if code == WATER:
+            self.waters += 1
+            self._count_pool_water(i,1)
+        keys = self.zkeys[i]
+        self.zhash ^= keys[self.state[i]] ^ keys[code]
+        self.state[i] = code
+        self.size[i] = size
+
+    def _count_pool_water(self,i,change):
+        """Change the water count of the pools containing index i."""
+        water = self.pool_water
+        short = self.pool_size - 1
+        for p in self.node_pools[i]:
+            w = water[p] + change
+            water[p] = w
+            if w == short:
+                self.pools_one_short.add(p)
+            else:
+                self.pools_one_short.discard(p)
+
     def set_node(self,node,val):
-        """Set node to val, carefully tracking board state."""
-        # Complicated logic here to determine water_connected status
+        """Set node to val, carefully tracking board state.
+        Overwriting a node that is not Empty rebuilds the island registry,
+        and so must not be mixed with pushed moves."""
+        i = self.index[node]
+        code = val.code
+        size = 0
+        if isinstance(val,Anchor) and not isinstance(val.size,str):
+            size = val.size
+
+        if self.state[i] != EMPTY:
+            # Overwriting a filled node can do anything to the water.
+            self._set_node(i,code,size)
+            self.water_connected = None
+            self._rebuild_islands()
+            self.reach = {}
+            self.reach_seen = {}
+            self.cut_memo = {}
+            self.scan = {}
+            self.scan_watch = {}
+            return
+
+        self._set_node(i,code,size)
+        anchored = False
+        if code == LAND:
+            anchored = self._join_island(i)
+        elif code == WATER:
+            self._close_frontiers(i)
+        if self.reach:
+            self._invalidate_reach(i,anchored)
+        if self.scan:
+            self._invalidate_scan(i,anchored)
+
+        # Filling an empty node never reconnects water, so only a True
+        # status needs work, and that work stays local to the node.
         if self.water_connected is True:
-            if isinstance(val,Land):
-                if self._nonLand_neighbors(node) > 1:
-                    self.water_connected = None
-            elif isinstance(val,Water):
-                if self._water_neighbors(node) == 0:
-                    self.water_connected = None
-        elif self.water_connected is False:
-            if self.is_Land(node):
-                if self._nonLand_neighbors(node) > 1:
-                    self.water_connected = None
-            elif self.is_Water(node):
-                if self._water_neighbors(node) == 0:
-                    self.water_connected = None
-
-        self._set_node(node,val)
+            if code == LAND:
+                self.water_connected = self._wet_still_connected(i)
+            elif code == WATER:
+                self.water_connected = self._water_reaches_water(i)
 
     def set_anchor(self,node,size):
-        """Create an anchor of given size at node n."""
+        """Create an anchor of given size at node n.
+        A letter for size makes a variable size anchor, which to begin
+        with could have any size that fits on the board."""
         assert self.is_Empty(node)
+        if isinstance(size,str):
+            self.variables[self.index[node]] = size
+            self.domains.setdefault(size,(1,len(self.nodes)))
+        else:
+            self.anchor_maxsize = max(self.anchor_maxsize,size)
         self.set_node(node,Anchor(size))
-        self.anchor_maxsize = max(self.anchor_maxsize,size)
         self.anchors.append(node)
 
     def clear_node(self,node):
@@ -79,84 +249,325 @@ class Board:
 
     def get_node(self,node):
         """Return the value of a node."""
-        return self.graph.node[node]['val']
+        return self._square(self.index[node])
 
     def is_Empty(self,node):
-        return isinstance(self.get_node(node),Empty)
-        
+        return self.state[self.index[node]] == EMPTY
+
     def is_Water(self,node):
-        return isinstance(self.get_node(node),Water)
+        return self.state[self.index[node]] == WATER
 
     def is_Land(self,node):
-        return isinstance(self.get_node(node),Land)
+        return self.state[self.index[node]] == LAND
 
     def is_Anchor(self,node):
         """Return size of Anchor or 0."""
-        me = self.get_node(node)
-        if isinstance(me,Anchor):
-            return me.size
-        else:
-            return 0
+        i = self.index[node]
+        if i in self.variables:
+            return self.variables[i]
+        return self.size[i]
 
     def push_move(self,node,val):
         """Make a move, saving board status on a stack for later pop."""
-        self.movestack.append((node,self.get_node(node),self.water_connected))
+        i = self.index[node]
+        assert self.state[i] == EMPTY
+        self.movestack.append((i,self.state[i],self.size[i],
+                               self.water_connected,len(self.trail)))
         self.set_node(node,val)
 
     def pop_move(self):
         """Undo an earlier pushed move."""
-        (node,oldval,self.water_connected) = self.movestack.pop()
-        self._set_node(node,oldval)
+        (i,code,size,self.water_connected,height) = self.movestack.pop()
+        self._undo_trail(height)
+        self._set_node(i,code,size)
+
+    def _undo_trail(self,height):
+        """Undo logged island registry changes down to given trail height."""
+        trail = self.trail
+        parent = self.isle_parent
+        nxt = self.isle_next
+        while len(trail) > height:
+            entry = trail.pop()
+            if entry[0] == _FRONTIER_ADD:
+                self.isle_frontier[entry[1]].add(entry[2])
+            elif entry[0] == _REACH:
+                (_,a,self.reach[a],self.reach_seen[a]) = entry
+            elif entry[0] == _DOMAIN:
+                (_,letter,self.domains[letter]) = entry
+            elif entry[0] == _SCAN:
+                (_,a,self.scan[a]) = entry
+            else: # _UNION
+                (_,small,big,added,anchors) = entry
+                parent[small] = small
+                self.isle_size[big] -= self.isle_size[small]
+                self.isle_frontier[big].difference_update(added)
+                self.isle_anchors[big] = anchors
+                (nxt[small],nxt[big]) = (nxt[big],nxt[small])
+
+    def island_root(self,i):
+        """Return the root index of the island containing Land index i."""
+        parent = self.isle_parent
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    def adjacent_islands(self,i):
+        """Return list of distinct island roots adjacent to index i."""
+        state = self.state
+        roots = []
+        for n in self.nbrs[i]:
+            if state[n] == LAND:
+                r = self.island_root(n)
+                if r not in roots:
+                    roots.append(r)
+        return roots
+
+    def _close_frontiers(self,i):
+        """Remove newly filled index i from adjacent island frontiers."""
+        roots = self.adjacent_islands(i)
+        for r in roots:
+            self.isle_frontier[r].discard(i)
+            self.trail.append((_FRONTIER_ADD,r,i))
+        return roots
+
+    def _join_island(self,i):
+        """Register new Land at index i, merging it with adjacent islands.
+        Return True if this gave an anchor to previously unanchored land."""
+        roots = self._close_frontiers(i)
+
+        state = self.state
+        self.isle_parent[i] = i
+        self.isle_next[i] = i
+        self.isle_size[i] = 1
+        if self.size[i] or i in self.variables:
+            self.isle_anchors[i] = [i]
+        else:
+            self.isle_anchors[i] = []
+        self.isle_frontier[i] = set([n for n in self.nbrs[i]
+                                     if state[n] == EMPTY])
+
+        unanchored = not self.isle_anchors[i]
+        for r in roots:
+            if not self.isle_anchors[r]:
+                unanchored = True
+        r = i
+        for other in roots:
+            r = self._union(r,other)
+        return unanchored and bool(self.isle_anchors[r])
+
+    def _union(self,a,b):
+        """Merge islands with roots a and b, returning the new root."""
+        if self.isle_size[a] > self.isle_size[b]:
+            (big,small) = (a,b)
+        else:
+            (big,small) = (b,a)
+        frontier = self.isle_frontier[big]
+        added = self.isle_frontier[small].difference(frontier)
+        anchors = self.isle_anchors[big]
+        self.trail.append((_UNION,small,big,added,anchors))
+
+        self.isle_parent[small] = big
+        self.isle_size[big] += self.isle_size[small]
+        frontier.update(added)
+        if self.isle_anchors[small]:
+            self.isle_anchors[big] = anchors + self.isle_anchors[small]
+        nxt = self.isle_next
+        (nxt[small],nxt[big]) = (nxt[big],nxt[small])
+        return big
+
+    def _rebuild_islands(self):
+        """Recreate the island registry from scratch."""
+        for i in range(len(self.nodes)):
+            self.isle_parent[i] = i
+            self.isle_next[i] = i
+        # empty out the land and fill it back in one node at a time
+        land = [i for i in range(len(self.nodes)) if self.state[i] == LAND]
+        for i in land:
+            self.state[i] = EMPTY
+        for i in land:
+            self.state[i] = LAND
+            self._join_island(i)
+        self.trail = []
 
     def in_pool(self,node):
         """Determine if the node is in a pool."""
-        possiblepools = self.pools[node]
-        for p in possiblepools:
-            ispool = True
-            for n in p:
-                if not self.is_Water(n):
-                    ispool = False
-            if ispool:
+        water = self.pool_water
+        for p in self.node_pools[self.index[node]]:
+            if water[p] == self.pool_size:
                 return True
         return False
 
-    def _ei(self,node,anchors):
-        """Recursive search of the island.  Add newly discovered Anchors
-        to the anchors list.
-        Return the island size and list of adjacent empty nodes."""
-
-        v = self.get_node(node)
-        if v.marked():
-            # been here before
-            return (0,[])
-        v.mark()
-
-        if self.is_Empty(node):
-            return (0,[node])
-        if not self.is_Land(node):
-            return (0,[])
-        
-        # found new piece of the island
-        if self.is_Anchor(node):
-            anchors.append(node)
-
-        # recursively check all neighbors
-        size = 1  # count this node
-        freedoms = []
-        for n in self.graph[node]:
-            (s,f) = self._ei(n,anchors)
-            size += s
-            freedoms.extend(f)
-
-        return (size,freedoms)
+    def pool_gaps(self):
+        """Return the Empty indices that are the only node of a pool
+        that is not Water."""
+        state = self.state
+        gaps = []
+        for p in self.pools_one_short:
+            for n in self.pool_list[p]:
+                if state[n] == EMPTY:
+                    gaps.append(n)
+        return gaps
+
+    def water_exits(self):
+        """Return a list giving the exits of each body of Water, the
+        Empty indices next to it, in order of the body's first index.
+        The list is empty if all the water is one body."""
+        state = self.state
+        nbrs = self.nbrs
+        seen = set()
+        bodies = []
+        for i in range(len(state)):
+            if state[i] != WATER or i in seen:
+                continue
+            # map out this body of water and its exits
+            seen.add(i)
+            stack = [i]
+            count = 0
+            exits = set()
+            while stack:
+                cur = stack.pop()
+                count += 1
+                for n in nbrs[cur]:
+                    if state[n] == WATER:
+                        if n not in seen:
+                            seen.add(n)
+                            stack.append(n)
+                    elif state[n] == EMPTY:
+                        exits.add(n)
+            if count == self.waters:
+                return []
+            bodies.append(list(exits))
+        return bodies
+
+    def water_cuts(self):
+        """Return the Empty indices without which the Water+Empty nodes
+        would fall apart into pieces that both hold water.  Empty if the
+        water is already split."""
+        state = self.state
+        if self.waters < 2:
+            return []
+        start = state.index(bytearray([WATER]))
+        (order,num,parent,low) = graphutil.low_points(
+            self.nbrs,start,lambda i: state[i] != LAND)
+
+        # water in the subtree of each node
+        wet = dict.fromkeys(order,0)
+        for v in reversed(order):
+            if state[v] == WATER:
+                wet[v] += 1
+            if parent[v] is not None:
+                wet[parent[v]] += wet[v]
+        if wet[start] != self.waters:
+            return []
+
+        # the root is water, so a cut off subtree with water is a split
+        cuts = set()
+        for v in order[1:]:
+            p = parent[v]
+            if state[p] == EMPTY and wet[v] and low[v] >= num[p]:
+                cuts.add(p)
+        return sorted(cuts)
+
+    def island_cuts(self):
+        """Return the Empty indices some anchored island has to grow
+        through: without them, its reach would leave it too little room
+        to reach its least size, or would lose unanchored land that no
+        other island can reach."""
+        state = self.state
+        reaches = {}
+        owners = {}     # root of unanchored land -> anchors reaching it
+        for a in self.anchors:
+            a = self.index[a]
+            reaches[a] = self.anchor_reach(a)
+            for n in reaches[a]:
+                if state[n] == LAND:
+                    owners.setdefault(self.island_root(n),set()).add(a)
+
+        cuts = set()
+        for (a,reach) in reaches.items():
+            root = self.island_root(a)
+            need = self.anchor_bounds(a)[0] - self.isle_size[root]
+            lonely = frozenset([r for (r,o) in owners.items()
+                                if o == set([a])])
+            if need <= 0 and not lonely:
+                continue
+            # a reach set is replaced, never changed, when its area changes
+            memo = self.cut_memo.get(a)
+            if memo is None or memo[0] is not reach or \
+                    memo[1] != (need,lonely):
+                memo = (reach,(need,lonely),
+                        self._island_cuts(a,reach,need,lonely))
+                self.cut_memo[a] = memo
+            cuts.update(memo[2])
+        return sorted(cuts)
+
+    def _island_cuts(self,a,reach,need,lonely):
+        """Return the Empty indices in reach that the island of anchor
+        index a has to grow through, as island_cuts, given the room it
+        needs and the roots of the unanchored land only it can reach."""
+        state = self.state
+        root = self.island_root(a)
+        def inside(i):
+            return i in reach or \
+                (state[i] == LAND and self.island_root(i) == root)
+        (order,num,parent,low) = graphutil.low_points(self.nbrs,a,inside)
+
+        # reach and lonely land in the subtree of each node
+        room = dict.fromkeys(order,0)
+        tied = dict.fromkeys(order,0)
+        for v in reversed(order):
+            if v in reach:
+                room[v] += 1
+                if state[v] == LAND and self.island_root(v) in lonely:
+                    tied[v] += 1
+            if parent[v] is not None:
+                room[parent[v]] += room[v]
+                tied[parent[v]] += tied[v]
+
+        # room lost along with each Empty node
+        cuts = set()
+        lost = {}
+        for v in order[1:]:
+            p = parent[v]
+            if state[p] == EMPTY and low[v] >= num[p]:
+                lost[p] = lost.get(p,0) + room[v]
+                if tied[v]:
+                    cuts.add(p)
+        for p in reach:
+            if state[p] == EMPTY and len(reach) - 1 - lost.get(p,0) < need:
+                cuts.add(p)
+        return cuts
 
     def explore_island(self,node):
-        """Return the size of the island containing node, and a list
-        of any Anchors in the island."""
-        Square.clear_marks()
-        anchors = []
-        (size,freedoms) = self._ei(node,anchors)
-        return (size,freedoms,anchors)
+        """Return the size of the island containing node, a list of
+        adjacent empty nodes, and a list of any Anchors in the island."""
+        self.island_explorations += 1
+        i = self.index[node]
+        code = self.state[i]
+        if code == EMPTY:
+            return (0,[node],[])
+        if code != LAND:
+            return (0,[],[])
+
+        nodes = self.nodes
+        r = self.island_root(i)
+        return (self.isle_size[r],
+                [nodes[n] for n in sorted(self.isle_frontier[r])],
+                [nodes[n] for n in self.isle_anchors[r]])
+
+    def island_nodes(self,node):
+        """Return a list of the nodes in the island containing node."""
+        i = self.index[node]
+        if self.state[i] != LAND:
+            return []
+        nodes = self.nodes
+        nxt = self.isle_next
+        island = [node]
+        n = nxt[i]
+        while n != i:
+            island.append(nodes[n])
+            n = nxt[n]
+        return island
 
     def legal_island(self,node):
         """True if the node is part of a legal island.
@@ -166,75 +577,585 @@ class Board:
         if len(anchors) > 1:
             return False
         if anchors:
-            wantsize = self.get_node(anchors[0]).size
-            if size == wantsize:
-                return True
-            if size < wantsize and freedoms:
+            (lo,hi) = self.anchor_bounds(self.index[anchors[0]])
+            if size > hi:
+                return False
+            if freedoms:
                 return True
-            return False
+            return size >= lo
 
         # no anchors.. free terrain.
         # needs to have a freedom and cap on size
-        return freedoms and size <= self.anchor_maxsize - 1
+        return freedoms and size <= self.max_island_size() - 1
 
-    def _has_water(self,bunch):
-        """True if there is a Water node in the list of nodes."""
-        for node in bunch:
-            if self.is_Water(node):
-                return True
+    def max_island_size(self):
+        """Return the largest size any island could have."""
+        biggest = self.anchor_maxsize
+        for (lo,hi) in self.domains.values():
+            biggest = max(biggest,hi)
+        return biggest
+
+    def anchor_bounds(self,a):
+        """Return (lo,hi) bounds on the wanted island size for the anchor
+        at index a.  They are equal unless the size is variable."""
+        if a in self.variables:
+            return self.domains[self.variables[a]]
+        return (self.size[a],self.size[a])
+
+    def anchor_target(self,a):
+        """Return the largest wanted island size for the anchor at index a."""
+        return self.anchor_bounds(a)[1]
+
+    def narrow_variable(self,letter,lo=None,hi=None):
+        """Narrow the range of the variable size named by letter to at
+        least lo and at most hi, saving the old range on the trail.
+        Return the new range, which is empty if lo > hi."""
+        old = self.domains[letter]
+        new = (old[0] if lo is None else max(lo,old[0]),
+               old[1] if hi is None else min(hi,old[1]))
+        if new == old:
+            return new
+        self.trail.append((_DOMAIN,letter,old))
+        self.domains[letter] = new
+        for (a,l) in self.variables.items():
+            if l != letter:
+                continue
+            # a smaller island can't reach as far
+            if new[1] < old[1] and self.reach.get(a) is not None:
+                self.trail.append((_REACH,a,self.reach[a],
+                                   self.reach_seen[a]))
+                self.reach[a] = None
+                self.reach_seen[a] = None
+            # and may be full, while a bigger one may be too small
+            if self.scan.get(a) is not None:
+                self.trail.append((_SCAN,a,self.scan[a]))
+                self.scan[a] = None
+        return new
+
+    def anchor_reach(self,a):
+        """Return the set of indices of Empty or unanchored Land nodes that
+        the island of the anchor at index a could grow into, given its
+        remaining size.  Unanchored land is counted as costing one node,
+        so the set may be too large, but never too small."""
+        reach = self.reach.get(a)
+        if reach is None:
+            # log the missing value, so pop_move forgets this search
+            self.trail.append((_REACH,a,None,None))
+            (reach,seen) = self._search_reach(a)
+            self.reach[a] = reach
+            self.reach_seen[a] = seen
+        return reach
+
+    def reach_counts(self):
+        """Return a dictionary keyed by index, giving the number of anchors
+        whose island could grow into that node.  Unreachable nodes are
+        left out."""
+        counts = {}
+        for a in self.anchors:
+            for n in self.anchor_reach(self.index[a]):
+                counts[n] = counts.get(n,0) + 1
+        return counts
+
+    def _search_reach(self,a):
+        """Bounded breadth-first search from the island of anchor index a.
+        Return the reached indices and all indices examined."""
+        state = self.state
+        nbrs = self.nbrs
+        root = self.island_root(a)
+        budget = self.anchor_target(a) - self.isle_size[root]
+        reached = set()
+        seen = set(self.isle_frontier[root])
+        if budget <= 0:
+            return (reached,seen)
+
+        def blocked(n):
+            # next to a different anchored island?
+            for r in self.adjacent_islands(n):
+                if r != root and self.isle_anchors[r]:
+                    return True
+            return False
+
+        layer = [n for n in self.isle_frontier[root] if not blocked(n)]
+        reached.update(layer)
+        dist = 1
+        while layer and dist < budget:
+            dist += 1
+            nextlayer = []
+            for cur in layer:
+                for n in nbrs[cur]:
+                    if n in seen:
+                        continue
+                    seen.add(n)
+                    if state[n] == WATER:
+                        continue
+                    if state[n] == LAND:
+                        if self.isle_anchors[self.island_root(n)]:
+                            continue
+                    elif blocked(n):
+                        continue
+                    reached.add(n)
+                    nextlayer.append(n)
+            layer = nextlayer
+        return (reached,seen)
+
+    def _changed(self,i,anchored):
+        """Return the indices whose neighborhood filling index i changed:
+        i and its neighbors, and next to any land i just connected to
+        an anchor."""
+        changed = set(self.nbrs[i])
+        changed.add(i)
+        if anchored:
+            for n in self.island_nodes(self.nodes[i]):
+                changed.add(self.index[n])
+                changed.update(self.nbrs[self.index[n]])
+        return changed
+
+    def _invalidate_reach(self,i,anchored):
+        """Forget reach sets that filling index i might have changed.
+        A search depends on the nodes it examined, and on whether their
+        neighbors belong to anchored islands."""
+        changed = self._changed(i,anchored)
+        trail = self.trail
+        for (a,seen) in self.reach_seen.items():
+            if seen is None or seen.isdisjoint(changed):
+                continue
+            trail.append((_REACH,a,self.reach[a],seen))
+            self.reach[a] = None
+            self.reach_seen[a] = None
+
+    def island_forced(self,a):
+        """Return (rank,index) pairs for the Empty nodes the island of
+        the anchor at index a forces: its whole frontier if it is full or
+        has only one free neighbor, otherwise the frontier nodes next to
+        another anchored island.  rank is 0 for the last free neighbor
+        of an island still too small, and 1 for the rest."""
+        found = self.scan.get(a)
+        if found is not None:
+            return found
+        # log the missing value, so pop_move forgets this result
+        self.trail.append((_SCAN,a,None))
+        root = self.island_root(a)
+        size = self.isle_size[root]
+        frontier = self.isle_frontier[root]
+        (lo,hi) = self.anchor_bounds(a)
+        if size >= hi or len(frontier) == 1:
+            rank = 0 if size < lo else 1
+            found = tuple([(rank,n) for n in frontier])
+        else:
+            found = []
+            for n in frontier:
+                for r in self.adjacent_islands(n):
+                    if r != root and self.isle_anchors[r]:
+                        found.append((1,n))
+                        break
+            found = tuple(found)
+        # this result only changes along with the frontier
+        for n in frontier:
+            self.scan_watch.setdefault(n,set()).add(a)
+        self.scan[a] = found
+        return found
+
+    def forced_frontier(self):
+        """Return the Empty indices forced by the islands, as for
+        island_forced, ordered so the most pressing is last."""
+        best = {}
+        for a in self.anchors:
+            for (rank,n) in self.island_forced(self.index[a]):
+                if rank < best.get(n,2):
+                    best[n] = rank
+        return sorted(best,key=lambda n: (best[n],n),reverse=True)
+
+    def _invalidate_scan(self,i,anchored):
+        """Forget the forced nodes of islands whose frontier filling
+        index i might have changed, or brought next to another anchored
+        island.  Islands are found through scan_watch, which is never
+        pruned: a stale entry only forgets a result needlessly."""
+        scan = self.scan
+        watch = self.scan_watch
+        trail = self.trail
+        for c in self._changed(i,anchored):
+            for a in watch.get(c,()):
+                if scan.get(a) is not None:
+                    trail.append((_SCAN,a,scan[a]))
+                    scan[a] = None
+
+    def _water_reaches_water(self,i):
+        """True if the new Water at index i shares a wet component with
+        the rest of the water.  Searches outward from i until it finds
+        other water."""
+        if self.waters == 1:
+            return True
+        state = self.state
+        nbrs = self.nbrs
+        seen = set([i])
+        stack = [i]
+        while stack:
+            for n in nbrs[stack.pop()]:
+                if n not in seen and state[n] != LAND:
+                    if state[n] == WATER:
+                        return True
+                    seen.add(n)
+                    stack.append(n)
         return False
 
-    def _water_neighbors(self,node):
-        """Return count of Water nodes neighboring given node."""
-        count = 0
-        for n in self.graph[node]:
-            if self.is_Water(n):
-                count += 1
-        return count
+    def _wet_still_connected(self,i):
+        """Given that water was connected before Land was placed at
+        index i, determine whether it still is.
 
-    def _nonLand_neighbors(self,node):
-        """Return count of non-Land nodes neighboring given node."""
-        count = 0
-        for n in self.graph[node]:
-            if not self.is_Land(n):
-                count += 1
-        return count
+        The wet neighbors of i are the only places the wet region can
+        have split.  Grow one breadth-first search from each of them in
+        turn, merging searches when they meet.  Usually they meet after
+        a few steps around i; otherwise a search runs dry, having
+        mapped out a whole component, and its water count decides."""
+        state = self.state
+        nbrs = self.nbrs
+        sources = [n for n in nbrs[i] if state[n] != LAND]
+        if len(sources) < 2:
+            return True
+
+        owner = {}      # wet index -> search that found it
+        merged = {}     # search -> search it was merged into
+        queues = {}     # active search -> queue of indices to expand
+        water = {}      # active search -> water count seen so far
+        for s in sources:
+            if s in owner:
+                continue
+            owner[s] = s
+            queues[s] = deque([s])
+            water[s] = 1 if state[s] == WATER else 0
+
+        def find(s):
+            while s in merged:
+                s = merged[s]
+            return s
+
+        while len(queues) > 1:
+            for s in list(queues):
+                if s not in queues:
+                    continue    # merged away during this round
+                q = queues[s]
+                if not q:
+                    # this search mapped out an entire wet component
+                    w = water.pop(s)
+                    del queues[s]
+                    if w == self.waters:
+                        return True
+                    if w:
+                        return False
+                    continue
+                cur = q.popleft()
+                for n in nbrs[cur]:
+                    if state[n] == LAND:
+                        continue
+                    o = owner.get(n)
+                    if o is None:
+                        owner[n] = s
+                        if state[n] == WATER:
+                            water[s] += 1
+                        q.append(n)
+                        continue
+                    o = find(o)
+                    if o != s:
+                        # two searches met; fold the shorter queue in
+                        if len(queues[o]) > len(q):
+                            (o,s) = (s,o)
+                        queues[s].extend(queues.pop(o))
+                        water[s] += water.pop(o)
+                        merged[o] = s
+                        q = queues[s]
+                        if len(queues) == 1:
+                            return True
+        return True
 
     def _water_connectedness_search(self):
         """True if Water+Empty nodes form a connected subgraph."""
-        wetset = [n for n in self.graph if not self.is_Land(n)]
-        wetgraph = self.graph.subgraph(wetset)
-        water_component = None
-        for component in nx.connected_components(wetgraph):
-            if self._has_water(component):
-                if water_component:
-                    return False # found second water component
-                else:
-                    water_component = component
-        return True
+        state = self.state
+        nbrs = self.nbrs
+        start = None
+        waters = 0
+        for i in range(len(state)):
+            if state[i] == WATER:
+                if start is None:
+                    start = i
+                waters += 1
+        if start is None:
+            return True
+
+        # flood the wet region from one water node, counting water seen
+        seen = set([start])
+        stack = [start]
+        found = 1
+        while stack:
+            for n in nbrs[stack.pop()]:
+                if n not in seen and state[n] != LAND:
+                    seen.add(n)
+                    if state[n] == WATER:
+                        found += 1
+                    stack.append(n)
+        return found == waters
 
     def connected_water(self):
+        self.connectivity_checks += 1
         if self.water_connected is None:
             self.water_connected = self._water_connectedness_search()
         return self.water_connected
 
 class BoardRectangle(Board):
-    """A rectangular square-grid Nurikabe board."""
+    """A rectangular square-grid Nurikabe board.  Node (x,y) has
+    index y*width + x."""
     def __init__(self,width,height):
         self.width = width
         self.height = height
-        Board.__init__(self,nx.grid_graph([width,height]))
+        Board.__init__(self,graphutil.GridGraph(width,height))
+
+    def start_node(self):
+        # from the middle, ties between branch nodes go to the middle
+        return (self.width//2,self.height//2)
+
+    def _shortest_cycles(self):
+        return graphutil.grid_cycles(self.width,self.height)
 
     def __str__(self):
         """ASCII art represenation of the board."""
         out = ''
         for y in range(self.height):
             for x in range(self.width):
-                out += str(self.get_node((x,y)))+' '
+                out += str(self._square(self.index[(x,y)]))+' '
             out += '\n'
 
         return out.rstrip('\n')
 
+def _indices(m):
+    """Return the list of indices of the bits set in m."""
+    out = []
+    while m:
+        low = m & -m
+        out.append(low.bit_length() - 1)
+        m ^= low
+    return out
+
+class BoardBits(BoardRectangle):
+    """A rectangular board that also keeps its Water and Land as
+    bitmasks, bit i for index i.  Flooding a region of the board, as
+    the water connectivity checks, water exits and anchor reach do,
+    takes a few shifts and masks per step rather than a step per node.
+    Pools are the 2x2 blocks of water, found the same way, so the pool
+    water counts of Board are not kept.
+
+    reach_seen holds bitmasks rather than sets, but anchor_reach still
+    returns sets of indices.
+    """
+    def __init__(self,width,height):
+        BoardRectangle.__init__(self,width,height)
+        n = len(self.nodes)
+        self.bit = [1 << i for i in range(n)]
+        self.full = (1 << n) - 1
+        left = 0
+        for y in range(height):
+            left |= 1 << (y*width)
+        # where a shift east or west can land without wrapping a row
+        self.not_left = self.full & ~left
+        self.not_right = self.full & ~(left << (width-1))
+        # top left corners of the 2x2 blocks
+        self.corners = self.not_right & (self.full >> width)
+        self.pool_bits = [[sum([self.bit[j] for j in self.pool_list[p]])
+                           for p in self.node_pools[i]] for i in range(n)]
+        self.water_bits = 0
+        self.land_bits = 0
+
+    def _spread(self,m):
+        """Return m and its neighbors, possibly with bits past the board."""
+        w = self.width
+        return (m | ((m << 1) & self.not_left) | ((m >> 1) & self.not_right)
+                | (m << w) | (m >> w))
+
+    def _set_node(self,i,code,size=0):
+        b = self.bit[i]
+        old = self.state[i]
+        if old == WATER:
+            self.waters -= 1
+            self.water_bits ^= b
+        elif old == LAND:
+            self.land_bits ^= b
+        if code == WATER:
+            self.waters += 1
+            self.water_bits |= b
+        elif code == LAND:
+            self.land_bits |= b
+        keys = self.zkeys[i]
+        self.zhash ^= keys[old] ^ keys[code]
+        self.state[i] = code
+        self.size[i] = size
+
+    def in_pool(self,node):
+        water = self.water_bits
+        for m in self.pool_bits[self.index[node]]:
+            if water & m == m:
+                return True
+        return False
+
+    def pool_gaps(self):
+        w = self.width
+        water = self.water_bits
+        empty = self.full & ~(water | self.land_bits)
+        # the four corners of each block, moved to its top left
+        (a,b,c,d) = (water,water >> 1,water >> w,water >> (w+1))
+        (ea,eb,ec,ed) = (empty,empty >> 1,empty >> w,empty >> (w+1))
+        tl = self.corners
+        gaps = ((ea & b & c & d & tl) | ((a & eb & c & d & tl) << 1) |
+                ((a & b & ec & d & tl) << w) |
+                ((a & b & c & ed & tl) << (w+1)))
+        return _indices(gaps)
+
+    def water_exits(self):
+        water = self.water_bits
+        empty = self.full & ~(water | self.land_bits)
+        (w,nl,nr) = (self.width,self.not_left,self.not_right)
+        bodies = []
+        rest = water
+        while rest:
+            body = rest & -rest
+            while True:
+                grown = (body | ((body << 1) & nl) | ((body >> 1) & nr) |
+                         (body << w) | (body >> w)) & water
+                if grown == body:
+                    break
+                body = grown
+            if body == water:
+                return []
+            bodies.append(_indices(self._spread(body) & empty))
+            rest &= ~body
+        return bodies
+
+    def _water_connectedness_search(self):
+        water = self.water_bits
+        if not water:
+            return True
+        wet = self.full & ~self.land_bits
+        (w,nl,nr) = (self.width,self.not_left,self.not_right)
+        region = water & -water
+        while region & water != water:
+            grown = (region | ((region << 1) & nl) | ((region >> 1) & nr) |
+                     (region << w) | (region >> w)) & wet
+            if grown == region:
+                return False
+            region = grown
+        return True
+
+    def _water_reaches_water(self,i):
+        if self.waters == 1:
+            return True
+        others = self.water_bits & ~self.bit[i]
+        wet = self.full & ~self.land_bits
+        (w,nl,nr) = (self.width,self.not_left,self.not_right)
+        region = self.bit[i]
+        while not region & others:
+            grown = (region | ((region << 1) & nl) | ((region >> 1) & nr) |
+                     (region << w) | (region >> w)) & wet
+            if grown == region:
+                return False
+            region = grown
+        return True
+
+    def _wet_still_connected(self,i):
+        """As Board._wet_still_connected, growing a flood from each wet
+        neighbor of i a step at a time, merging floods that meet."""
+        state = self.state
+        floods = [self.bit[n] for n in self.nbrs[i] if state[n] != LAND]
+        water = self.water_bits
+        wet = self.full & ~self.land_bits
+        (w,nl,nr) = (self.width,self.not_left,self.not_right)
+        while len(floods) > 1:
+            grown = []
+            for f in floods:
+                g = (f | ((f << 1) & nl) | ((f >> 1) & nr) |
+                     (f << w) | (f >> w)) & wet
+                if g == f:
+                    # this flood mapped out an entire wet component
+                    if g & water == water:
+                        return True
+                    if g & water:
+                        return False
+                    continue
+                k = 0
+                while k < len(grown):
+                    if grown[k] & g:
+                        g |= grown.pop(k)
+                    else:
+                        k += 1
+                grown.append(g)
+            floods = grown
+        return True
+
+    def _island_bits(self,i):
+        """Return the bits of the island containing Land index i."""
+        nxt = self.isle_next
+        bits = self.bit
+        m = bits[i]
+        n = nxt[i]
+        while n != i:
+            m |= bits[n]
+            n = nxt[n]
+        return m
+
+    def _search_reach(self,a):
+        root = self.island_root(a)
+        budget = self.anchor_target(a) - self.isle_size[root]
+        bits = self.bit
+        frontier = 0
+        for n in self.isle_frontier[root]:
+            frontier |= bits[n]
+        if budget <= 0:
+            return (set(),frontier)
+
+        # land of all the anchored islands, and of the others than this
+        anchored = 0
+        others = 0
+        done = set()
+        for node in self.anchors:
+            r = self.island_root(self.index[node])
+            if r not in done:
+                done.add(r)
+                m = self._island_bits(r)
+                anchored |= m
+                if r != root:
+                    others |= m
+        land = self.land_bits
+        empty = self.full & ~(self.water_bits | land)
+        # Empty nodes next to another anchored island are blocked
+        blocked = self._spread(others)
+        passable = (empty & ~blocked) | (land & ~anchored)
+
+        layer = frontier & ~blocked
+        reached = layer
+        unseen = self.full & ~frontier
+        dist = 1
+        (w,nl,nr) = (self.width,self.not_left,self.not_right)
+        while layer and dist < budget:
+            dist += 1
+            new = (((layer << 1) & nl) | ((layer >> 1) & nr) |
+                   (layer << w) | (layer >> w)) & unseen
+            unseen &= ~new
+            layer = new & passable
+            reached |= layer
+        return (set(_indices(reached)),self.full & ~unseen)
+
+    def _invalidate_reach(self,i,anchored):
+        if anchored:
+            changed = self._spread(self._island_bits(i))
+        else:
+            changed = self._spread(self.bit[i])
+        trail = self.trail
+        for (a,seen) in self.reach_seen.items():
+            if seen is None or not seen & changed:
+                continue
+            trail.append((_REACH,a,self.reach[a],seen))
+            self.reach[a] = None
+            self.reach_seen[a] = None
+
+# board classes for square grids, by name
+ENGINES = {'cells':BoardRectangle, 'bits':BoardBits}
+
 if __name__=='__main__':
     logging.basicConfig(level=logging.DEBUG)
 
@@ -293,3 +1214,73 @@ if __name__=='__main__':
     print '   Base  : size, free, anchors, Legal?'
     for n in [(0,0),(2,2),(2,1)]:
         print ' ',n,':',b.explore_island(n),'\t',b.legal_island(n)
+
+    # The engines must search alike: on random small puzzles, each
+    # strategy visits the same search nodes and finds the same
+    # solutions on every engine.
+    import itertools
+    import branching
+    import solver
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(0)
+    for trial in range(100):
+        (w,h) = (random.randint(2,6),random.randint(2,6))
+        anchors = {}
+        for k in range(random.randint(1,4)):
+            n = (random.randrange(w),random.randrange(h))
+            anchors[n] = random.choice(range(1,min(9,w*h//2)+1) + ['a'])
+        found = {}
+        for engine in ENGINES:
+            for branch in ['reach','wdeg']:
+                b = ENGINES[engine](w,h)
+                for (n,size) in sorted(anchors.items()):
+                    b.set_anchor(n,size)
+                for letter in b.domains:
+                    b.narrow_variable(letter,1,5)
+                s = solver.Solver(b,brancher=branching.brancher(branch))
+                s.max_nodes = 500
+                sols = list(itertools.islice(s.iter_solutions(),30))
+                found.setdefault(branch,{})[engine] = (s.search_nodes,sols)
+        for branch in found:
+            assert len(set(map(repr,found[branch].values()))) == 1, \
+                '%s search differs on engines:\n%s' % (branch,b)
+    print
+    print 'Engines %s search 100 random boards alike.' % \
+        ' and '.join(sorted(ENGINES))
+
+    # The island scans kept across moves must match a fresh scan, after
+    # any mix of pushed and popped moves and narrowed variable sizes.
+    random.seed(0)
+    checks = 0
+    for trial in range(100):
+        (w,h) = (random.randint(2,6),random.randint(2,6))
+        b = ENGINES[random.choice(list(ENGINES))](w,h)
+        nodes = list(b.nodes)
+        random.shuffle(nodes)
+        for n in nodes[:random.randint(1,4)]:
+            b.set_anchor(n,random.choice([1,2,3,4,5,'a']))
+        for letter in b.domains:
+            b.narrow_variable(letter,1,5)
+        for step in range(40):
+            empty = [n for n in b.nodes if b.is_Empty(n)]
+            if b.movestack and (not empty or random.random() < 0.3):
+                b.pop_move()
+            elif empty:
+                b.push_move(random.choice(empty),
+                            random.choice([Water,Land])())
+                if b.domains and random.random() < 0.3:
+                    (lo,hi) = b.domains['a']
+                    if random.random() < 0.5:
+                        b.narrow_variable('a',lo=min(lo+1,hi))
+                    else:
+                        b.narrow_variable('a',hi=max(lo,hi-1))
+            anchors = [b.index[a] for a in b.anchors]
+            kept = [sorted(b.island_forced(a)) for a in anchors]
+            (scan,watch) = (b.scan,b.scan_watch)
+            b.scan = {}
+            b.scan_watch = {}
+            fresh = [sorted(b.island_forced(a)) for a in anchors]
+            (b.scan,b.scan_watch) = (scan,watch)
+            assert kept == fresh, 'stale island scan:\n%s' % b
+            checks += 1
+    print 'Island scans kept across %d moves match fresh scans.' % checks
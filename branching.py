@@ -0,0 +1,136 @@
+"""
+branching module
+   Strategies for the solver's choice of node to branch on, when no
+   node is forced, and of the order to try its values in.
+
+2015 Bryan Clair
+"""
+
+from array import array
+
+from squares import *
+
+# value orders, by name
+VALUES = {'water':[Water, Land], 'land':[Land, Water]}
+
+class Brancher:
+    """Base strategy: branch on the first Empty node in BFS order.
+
+    A strategy is given the solver to look at the board, and must
+    choose deterministically from the board state if the parallel
+    solver is to return solutions in serial order.  If the solver
+    sets rng to a random.Random, ties are broken at random instead of
+    by BFS order.
+    """
+    def __init__(self,values='water'):
+        self.values = VALUES[values]
+        self.rng = None
+
+    def choose(self,solver):
+        """Return an Empty node to branch on, or None if the board is full.
+        Without BFS order, every Empty node ties."""
+        if self.rng:
+            return _pick(self.rng,solver,lambda i: 0)
+        board = solver.board
+        node = solver.basenode
+        while node is not None and not board.is_Empty(node):
+            node = solver.bfs_next[node]
+        return node
+
+    def order(self,node):
+        """Return the types to try at node, in order."""
+        return self.values
+
+    def failed(self,solver,node):
+        """Note that a value at node was ruled out."""
+        pass
+
+class Reach(Brancher):
+    """Branch on the Empty node fewest anchors can reach, earliest in
+    BFS order: a node no island can reach is water, and one only one
+    island can reach decides that island's shape."""
+    def choose(self,solver):
+        board = solver.board
+        counts = board.reach_counts()
+        if self.rng:
+            return _pick(self.rng,solver,
+                         lambda i: -counts.get(i,0))
+        best = None
+        node = solver.basenode
+        while node is not None:
+            if board.is_Empty(node):
+                c = counts.get(board.index[node],0)
+                if best is None or c < bestcount:
+                    (best,bestcount) = (node,c)
+                    if c <= 1:
+                        break
+            node = solver.bfs_next[node]
+        return best
+
+class WeightedDegree(Brancher):
+    """Failure-driven branching, after dom/wdeg.  Every value ruled out
+    at a node adds to the weight of the node, and branching is on the
+    Empty node with the heaviest neighborhood per reaching anchor,
+    earliest in BFS order.
+
+    The weights depend on the search so far, so parallel workers each
+    learn their own, and solutions need not come out in serial order.
+    """
+    def __init__(self,values='water'):
+        Brancher.__init__(self,values)
+        self.weight = None
+
+    def _weights(self,board):
+        if self.weight is None:
+            self.weight = array('i',[1]*len(board.nodes))
+        return self.weight
+
+    def choose(self,solver):
+        board = solver.board
+        weight = self._weights(board)
+        nbrs = board.nbrs
+        counts = board.reach_counts()
+        def score(i):
+            total = weight[i]
+            for n in nbrs[i]:
+                total += weight[n]
+            return float(total) / (1 + counts.get(i,0))
+        if self.rng:
+            return _pick(self.rng,solver,score)
+        best = None
+        node = solver.basenode
+        while node is not None:
+            if board.is_Empty(node):
+                s = score(board.index[node])
+                if best is None or s > bestscore:
+                    (best,bestscore) = (node,s)
+            node = solver.bfs_next[node]
+        return best
+
+    def failed(self,solver,node):
+        board = solver.board
+        self._weights(board)[board.index[node]] += 1
+
+def _pick(rng,solver,score):
+    """Return a random one of the Empty nodes with the highest score
+    of their index, or None if there are none."""
+    board = solver.board
+    state = board.state
+    best = []
+    for i in range(len(state)):
+        if state[i] == EMPTY:
+            s = score(i)
+            if not best or s > bestscore:
+                (best,bestscore) = ([i],s)
+            elif s == bestscore:
+                best.append(i)
+    if not best:
+        return None
+    return board.nodes[rng.choice(best)]
+
+# strategies, by name
+STRATEGIES = {'bfs':Brancher, 'reach':Reach, 'wdeg':WeightedDegree}
+
+def brancher(name='reach',values='water'):
+    """Return a new strategy, given the names of it and its value order."""
+    return STRATEGIES[name](values)
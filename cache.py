@@ -0,0 +1,162 @@
+"""
+cache module
+   On-disk cache of puzzle solutions.  A puzzle is filed under a
+   canonical form, the least of its 8 rotations and reflections, so a
+   puzzle turned or mirrored finds the solutions of the original.
+
+2015 Bryan Clair
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+
+# where the cache lives, unless given
+DEFAULT_PATH = os.environ.get('NURIKABE_CACHE',
+                              os.path.join(os.path.expanduser('~'),
+                                           '.cache','nurikabe'))
+
+# most bytes of entries to keep
+MAX_BYTES = 64 << 20
+
+# version of the entry format
+FORMAT = 1
+
+# the symmetries of the square grid, as (transpose, flip x, flip y),
+# applied in that order
+SYMMETRIES = [(t,fx,fy) for t in (False,True)
+              for fx in (False,True) for fy in (False,True)]
+
+def transform(grid,symmetry):
+    """Return the grid (a list of rows) moved by symmetry."""
+    (t,fx,fy) = symmetry
+    rows = [list(r) for r in grid]
+    if t:
+        rows = [list(r) for r in zip(*rows)]
+    if fy:
+        rows = rows[::-1]
+    if fx:
+        rows = [r[::-1] for r in rows]
+    return rows
+
+def inverse(symmetry):
+    """Return the symmetry undoing symmetry."""
+    (t,fx,fy) = symmetry
+    if t:
+        return (t,fy,fx)
+    return symmetry
+
+def canonical(layout):
+    """Return the canonical text of a puzzle layout, and the symmetry
+    taking the layout to it."""
+    grid = layout.split()
+    best = None
+    for sym in SYMMETRIES:
+        text = '\n'.join([''.join(r) for r in transform(grid,sym)])
+        if best is None or text < best:
+            (best,bestsym) = (text,sym)
+    return (best,bestsym)
+
+def _grid(solution):
+    """Return a solution as printed by the board, as a list of rows."""
+    return [line.split() for line in solution.split('\n')]
+
+def _text(grid):
+    """Return a grid in the form the board prints it."""
+    return '\n'.join([''.join([c+' ' for c in r]) for r in grid])
+
+class Cache:
+    """A directory of solved puzzles, one JSON file each.
+
+    Each file holds the canonical puzzle, its solutions in the
+    canonical orientation, whether they are all of them, and a few
+    statistics of the search that found them.  Once the files take up
+    more than max_bytes, the least recently used are removed.
+    Problems with the directory are logged and otherwise ignored.
+    """
+    def __init__(self,path=DEFAULT_PATH,max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _key(self,layout,maxvars):
+        """Return the canonical text, symmetry and file for a puzzle."""
+        (text,sym) = canonical(layout)
+        if any([c.islower() for c in text]):
+            # variable island sizes depend on their range
+            text += '\nmaxvars=%d' % maxvars
+        name = hashlib.sha1(text).hexdigest() + '.json'
+        return (text,sym,os.path.join(self.path,name))
+
+    def _read(self,filename,text):
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+        except (IOError,ValueError):
+            return None
+        if entry.get('format') != FORMAT or entry.get('puzzle') != text:
+            return None
+        return entry
+
+    def lookup(self,layout,maxvars=9,limit=None):
+        """Return the cached solutions of a puzzle, turned back to the
+        layout's orientation, and whether they are all of them.
+        Return None if the cache can't give all the solutions, or
+        limit of them."""
+        (text,sym,filename) = self._key(layout,maxvars)
+        entry = self._read(filename,text)
+        if entry is None:
+            return None
+        grids = entry['solutions']
+        if not entry['complete'] and (limit is None or len(grids) < limit):
+            return None
+        try:
+            os.utime(filename,None)
+        except OSError:
+            pass
+        logging.info('Found %d solutions in cache %s',len(grids),filename)
+        back = inverse(sym)
+        return ([_text(transform(g,back)) for g in grids],entry['complete'])
+
+    def store(self,layout,maxvars,solutions,complete,stats=None):
+        """Save solutions of a puzzle, as printed by the board.
+        complete says whether they are all of them.  A complete entry
+        is never replaced by an incomplete one."""
+        (text,sym,filename) = self._key(layout,maxvars)
+        old = self._read(filename,text)
+        if old and not complete and (old['complete'] or
+                                     len(old['solutions']) >= len(solutions)):
+            return
+        entry = {'format':FORMAT, 'puzzle':text, 'complete':complete,
+                 'solutions':[[''.join(r) for r in transform(_grid(s),sym)]
+                              for s in solutions],
+                 'stats':stats or {}}
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(filename+'.tmp','w') as f:
+                json.dump(entry,f)
+            os.rename(filename+'.tmp',filename)
+            self._evict()
+        except (IOError,OSError) as e:
+            logging.warning('Could not write cache %s: %s',filename,e)
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        files = []
+        total = 0
+        for name in glob.glob(os.path.join(self.path,'*.json')):
+            st = os.stat(name)
+            files.append((st.st_mtime,st.st_size,name))
+            total += st.st_size
+        files.sort()
+        while total > self.max_bytes and files:
+            (mtime,size,name) = files.pop(0)
+            os.remove(name)
+            total -= size
+
+    def clear(self):
+        """Remove every entry."""
+        for name in glob.glob(os.path.join(self.path,'*.json')):
+            os.remove(name)
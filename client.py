@@ -0,0 +1,162 @@
+#!/usr/bin/python
+"""
+Nurikabe solver client
+2015 Bryan Clair
+
+Sends puzzles to a solver started with `nurikabe.py --serve`, and
+prints one JSON record per puzzle as they are solved, as `--batch`
+does.  It imports nothing of the solver, so it starts quickly.
+With no files, the puzzle is read from stdin.  Interrupting the
+client cancels the puzzles it is waiting for.
+"""
+
+import httplib
+import json
+import os
+import Queue
+import sys
+import threading
+import urllib
+
+# port the solver daemon listens on, on localhost
+DEFAULT_PORT = 8015
+
+def request(method,path,params=None,body=None,port=DEFAULT_PORT):
+    """Make a request of the daemon, returning its JSON answer."""
+    if params:
+        path += '?' + urllib.urlencode(params)
+    conn = httplib.HTTPConnection('127.0.0.1',port)
+    try:
+        conn.request(method,path,body)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+def solve(layout,port=DEFAULT_PORT,**params):
+    """Return the daemon's record of a puzzle, given as text.
+    params are options of the request: id, limit, maxvars, timeout,
+    node_limit, branch, values, restarts, seed, engine and probe."""
+    return request('POST','/solve',params,layout,port)
+
+def cancel(id,port=DEFAULT_PORT):
+    """Cancel the puzzle sent with id.  Return False if the daemon
+    has no such puzzle queued or running."""
+    return request('POST','/cancel',{'id':id},port=port)['cancelled']
+
+def status(port=DEFAULT_PORT):
+    """Return the daemon's counts of workers and puzzles."""
+    return request('GET','/status',port=port)
+
+def _submit(work,results,port,params):
+    """Solve puzzles from work, putting their records in results."""
+    while True:
+        try:
+            (path,id) = work.get_nowait()
+        except Queue.Empty:
+            return
+        try:
+            if path is None:
+                layout = sys.stdin.read()
+            else:
+                with open(path) as f:
+                    layout = f.read()
+            record = solve(layout,port,id=id,**params)
+            # records of bad requests don't give the id
+            record.setdefault('id',id)
+        except (IOError,ValueError,httplib.HTTPException) as e:
+            record = {'status':'error', 'error':str(e), 'id':id}
+        if path is not None:
+            record['name'] = os.path.basename(path)
+            record['path'] = path
+        results.put(record)
+
+def run(paths,out=sys.stdout,jobs=8,port=DEFAULT_PORT,**params):
+    """Solve the puzzles in files (or stdin, if there are none), with
+    up to jobs of them sent at once, writing each record to out.
+    Return a dictionary counting puzzles by status."""
+    work = Queue.Queue()
+    ids = []
+    for (n,path) in enumerate(paths or [None]):
+        ids.append('%d-%d' % (os.getpid(),n))
+        work.put((path,ids[-1]))
+    results = Queue.Queue()
+    for j in range(min(jobs,len(ids))):
+        t = threading.Thread(target=_submit,args=(work,results,port,params))
+        t.daemon = True
+        t.start()
+
+    counts = {}
+    try:
+        for n in range(len(ids)):
+            # a timeout keeps the wait interruptible
+            record = results.get(True,1e9)
+            ids.remove(record['id'])
+            out.write(json.dumps(record,sort_keys=True)+'\n')
+            out.flush()
+            counts[record['status']] = counts.get(record['status'],0) + 1
+    except KeyboardInterrupt:
+        for id in ids:
+            try:
+                cancel(id,port)
+            except IOError:
+                pass
+        raise
+    return counts
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*',
+                        help="Puzzle files to solve.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="Port the daemon listens on.")
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help="Most puzzles to send at once.")
+    parser.add_argument('-1', '--first', action='store_true',
+                        help="Stop after the first solution.")
+    parser.add_argument('-u', '--unique', action='store_true',
+                        help="Only check for a unique solution: stop after the second.")
+    parser.add_argument('-m', '--maxvars', type=int,
+                        help="Max size of variable islands.")
+    parser.add_argument('-t', '--timeout', type=float,
+                        help="Seconds allowed for each puzzle.")
+    parser.add_argument('-n', '--node-limit', type=int,
+                        help="Search nodes allowed for each puzzle.")
+    parser.add_argument('--engine',
+                        help="Board engine to solve with.")
+    parser.add_argument('--probe', action='store_true',
+                        help="Probe nodes for failed literals before branching.")
+    parser.add_argument('--cancel', metavar='ID',
+                        help="Cancel the puzzle sent with this id.")
+    parser.add_argument('--status', action='store_true',
+                        help="Show what the daemon is doing.")
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            print json.dumps(status(args.port),sort_keys=True)
+            sys.exit(0)
+        if args.cancel:
+            if not cancel(args.cancel,args.port):
+                sys.exit('No puzzle %s.' % args.cancel)
+            sys.exit(0)
+
+        params = {}
+        if args.first:
+            params['limit'] = 1
+        elif args.unique:
+            params['limit'] = 2
+        for name in ['maxvars','timeout','node_limit','engine']:
+            if getattr(args,name) is not None:
+                params[name] = getattr(args,name)
+        if args.probe:
+            params['probe'] = 1
+        counts = run(args.files,jobs=args.jobs,port=args.port,**params)
+    except IOError as e:
+        sys.exit('Cannot reach the solver on port %d: %s' % (args.port,e))
+    except KeyboardInterrupt:
+        sys.exit(1)
+    if counts.get('error'):
+        sys.exit(1)
@@ -1,92 +1,208 @@
 """
 graphutil module
-   Graph utility functions not built into networkx
+   Graph utility functions not built into networkx, and a grid graph
+   that needs no networkx.
 
 2015 Bryan Clair
 """
 
-import networkx as nx
+from collections import deque
+
+class GridGraph:
+    """A width by height grid graph, with nodes (x,y) in row order.
+    Has enough of the networkx graph interface for a Board."""
+    def __init__(self,width,height):
+        self.width = width
+        self.height = height
+        self.order = [(x,y) for y in range(height) for x in range(width)]
+        self.adj = {}
+        for (x,y) in self.order:
+            self.adj[(x,y)] = tuple([(x+dx,y+dy) for (dx,dy) in
+                                     [(0,-1),(-1,0),(1,0),(0,1)]
+                                     if 0 <= x+dx < width and
+                                     0 <= y+dy < height])
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self,node):
+        return node in self.adj
+
+    def __getitem__(self,node):
+        """Return the neighbors of node."""
+        return self.adj[node]
+
+    def nodes(self):
+        return list(self.order)
+
+    def edges(self):
+        return [(n,m) for n in self.order for m in self.adj[n] if n < m]
 
 def bfs_list(g,source):
     """
     Return a dictionary keyed by nodes, giving the successor in BFS from
     that node.  Not quite what networkx's built in bfs_successors does.
     """
-    bfs = nx.bfs_successors(g,source)
-    next = [source]
+    seen = set([source])
+    next = deque([source])
     d = {}
     while next:
-        cur = next.pop(0)
-        if cur in bfs:
-            next.extend(bfs[cur])
+        cur = next.popleft()
+        for n in g[cur]:
+            if n not in seen:
+                seen.add(n)
+                next.append(n)
         if next:
             d[cur] = next[0]
     d[cur] = None
     return d
 
+def low_points(nbrs,root,inside):
+    """
+    Depth first search from index root over the indices i for which
+    inside(i) is true, where nbrs[i] lists the neighbors of index i.
+    Return (order,num,parent,low): the indices reached, in preorder,
+    and dictionaries giving the position of each in order, its parent
+    in the search tree and its low point, the least position reached
+    from its subtree by a single back edge.  Removing the parent p of
+    an index i cuts off the subtree of i exactly when low[i] >= num[p].
+    """
+    num = {root:0}
+    parent = {root:None}
+    low = {root:0}
+    order = [root]
+    stack = [(root,iter(nbrs[root]))]
+    while stack:
+        (v,rest) = stack[-1]
+        for n in rest:
+            if not inside(n):
+                continue
+            if n not in num:
+                num[n] = low[n] = len(order)
+                order.append(n)
+                parent[n] = v
+                stack.append((n,iter(nbrs[n])))
+                break
+            elif n != parent[v] and num[n] < low[v]:
+                low[v] = num[n]
+        else:
+            stack.pop()
+            p = parent[v]
+            if p is not None and low[v] < low[p]:
+                low[p] = low[v]
+    return (order,num,parent,low)
+
+# pools already found, keyed by graph shape
+_cycle_cache = {}
+_CACHE_SIZE = 32
+
 def find_shortest_cycles(g):
     """
     Return a pair (girth, d)
     where d is a dictionary keyed by nodes, each entry of which
     has a list of the shortest cycles containing the key node.
     If graph is a tree, raises a ValueError.
+    Results are cached by the edges of the graph, and must not be changed.
     """
-    cycles = []
-    # start with all possible length 0 paths
-    girth = 0
-    paths =[[n] for n in g]
-    closed = False
-    tree = False
-    while not closed and not tree:
-        # detect trees
-        tree = True
-        # build all paths that are one step longer
-        newpaths = []
-        girth += 1
-        for p in paths:
-            head = p[0]
-            try:
-                last = p[1]
-            except IndexError:
-                last = None
-
-            # loop through neighbors of the head of path, making new paths
-            for nbr in g[p[0]]:
-                # don't backtrack
-                if nbr == last:
-                    continue
-                tree = False # don't quit yet - paths still growing
-                # check if cycle closed
-                if nbr == p[-1]:
-                    closed = True
-                    newpaths.append(p)
-                else:
-                    newp = [nbr]
-                    newp.extend(p)
-                    newpaths.append(newp)
-        paths = newpaths
-
-    if tree:
+    key = frozenset([frozenset(e) for e in g.edges()])
+    if key not in _cycle_cache:
+        if len(_cycle_cache) >= _CACHE_SIZE:
+            _cycle_cache.clear()
+        _cycle_cache[key] = _shortest_cycles(g)
+    return _cycle_cache[key]
+
+def _girth(g,order):
+    """Return the length of the shortest cycle in g, or None for a forest.
+    Each node's BFS stops once it can't beat the best cycle so far."""
+    best = None
+    for s in order:
+        dist = {s:0}
+        parent = {s:None}
+        queue = deque([s])
+        while queue:
+            cur = queue.popleft()
+            if best is not None and 2*dist[cur] + 1 >= best:
+                break
+            for nbr in g[cur]:
+                if nbr not in dist:
+                    dist[nbr] = dist[cur] + 1
+                    parent[nbr] = cur
+                    queue.append(nbr)
+                elif nbr != parent[cur]:
+                    # a closed walk through s, a cycle if it is shortest
+                    length = dist[cur] + dist[nbr] + 1
+                    if best is None or length < best:
+                        best = length
+    return best
+
+def _shortest_cycles(g):
+    """find_shortest_cycles without the cache."""
+    order = list(g)
+    girth = _girth(g,order)
+    if girth is None:
         raise ValueError('graph is a tree')
 
-    # pick only the closed paths (which have the correct length)
-    # then eliminate duplicates by making into a set
-    cycles = set([frozenset(c) for c in paths if len(c)==girth])
+    # Each cycle is found from its first node in order, walking only
+    # through later nodes, so it is found twice (once each way round).
+    rank = dict((n,i) for (i,n) in enumerate(order))
+    cycles = set()
+    for s in order:
+        r = rank[s]
+        path = [s]
+        stack = [iter(g[s])]
+        while stack:
+            for nbr in stack[-1]:
+                if len(path) == girth:
+                    if nbr == s:
+                        cycles.add(frozenset(path))
+                elif rank[nbr] > r and nbr not in path:
+                    path.append(nbr)
+                    stack.append(iter(g[nbr]))
+                    break
+            else:
+                stack.pop()
+                path.pop()
 
     # build a dictionary of cycles keyed by nodes
-    d = {}
-    for n in g:
-        d[n] = [c for c in cycles if n in c]
+    d = dict((n,[]) for n in g)
+    for c in cycles:
+        for n in c:
+            d[n].append(c)
 
     return (girth,d)
 
+def grid_cycles(width,height):
+    """
+    find_shortest_cycles for a width by height grid graph, with nodes
+    (x,y): the shortest cycles are the 2x2 blocks.
+    """
+    key = ('grid',width,height)
+    if key not in _cycle_cache:
+        if width < 2 or height < 2:
+            raise ValueError('graph is a tree')
+        if len(_cycle_cache) >= _CACHE_SIZE:
+            _cycle_cache.clear()
+        d = dict(((x,y),[]) for x in range(width) for y in range(height))
+        for x in range(width-1):
+            for y in range(height-1):
+                c = frozenset([(x,y),(x+1,y),(x,y+1),(x+1,y+1)])
+                for n in c:
+                    d[n].append(c)
+        _cycle_cache[key] = (4,d)
+    return _cycle_cache[key]
+
 if __name__=='__main__':
+    import networkx as nx
+
     sep = '-'*30
     print sep
     print 'bfs_list'
     print sep
     print '4x3 grid'
-    g = nx.grid_graph([4,3])
+    g = GridGraph(4,3)
     n = (0,0)
     d = bfs_list(g,n)
     while n:
@@ -98,7 +214,7 @@ if __name__=='__main__':
     print 'find_shortest_cycles'
     print sep
     size = 6
-    g = nx.grid_graph([size,size])
+    g = GridGraph(size,size)
     (girth,d) = find_shortest_cycles(g)
     print size,'x',size,' grid has girth',girth,'and nodes have this many short cycles:'
     for y in range(size):
@@ -14,25 +14,31 @@ Board spaces can be:
 *      +        Land
 """
 
-import re
 import sys
+import json
 import logging
+import os
+import signal
 import time
 import solver
 import board
+import branching
+import cache
+import client
 from squares import *
 
-def parse_board(data,coding={'.':Empty,'+':Land,'#':Water}):
+def parse_board(data,coding={'.':Empty,'+':Land,'#':Water},engine='cells'):
     """Create a rectangular square-grid board from an ASCII representation.
     Can give the coding as a dictionary keyed on char with values the type
-    of node (Empty, Land, Water), but anchors must be ASCII 1-9."""
+    of node (Empty, Land, Water), but anchors must be ASCII 1-9.
+    engine names the board class, one of board.ENGINES."""
     rows = data.split()
     cols = len(rows[0])
     for r in rows:
         if len(r) != cols:
             raise ValueError('All rows must be the same width.')
 
-    b = board.BoardRectangle(cols,len(rows))
+    b = board.ENGINES[engine](cols,len(rows))
 
     (x,y) = (0,0)
     for r in rows:
@@ -56,26 +62,128 @@ def parse_board(data,coding={'.':Empty,'+':Land,'#':Water}):
 
     return b
 
-def solve(layout,vals='123456789',depth=''):
-    """Solve a nurikabe puzzle by trying all possible values for variable island sizes,
-    then creating a board and calling the simple nurikabe solver."""
-    match = re.search('[a-z]',layout)
-    if not match:
-        b = parse_board(layout)
-        logging.info(depth)
-        solutions = solver.Solver(b).solve()
-        if solutions and depth:
-            print depth
-        for s in solutions:
-            print s
-            print
-        return solutions
-    else:
-        letter = match.group(0)
-        solutions = []
-        for v in vals:
-            solutions.extend(solve(layout.replace(letter,v), vals, depth + letter+'='+v+' '))
-        return solutions
+def assignment(layout,solution):
+    """Return a string giving the values of the variable island sizes
+    of layout in a solution, like 'a=3 b=5 '."""
+    rows = layout.split()
+    srows = [r.split() for r in solution.split('\n')]
+    values = ''
+    for (y,r) in enumerate(rows):
+        for (x,c) in enumerate(r):
+            if c.islower() and c+'=' not in values:
+                values += c+'='+srows[y][x]+' '
+    return values
+
+def solve(layout,maxvars=9,jobs=1,limit=None,stats=None,
+          branch='reach',values='water',checkpoint=None,resume=None,
+          timeout=None,node_limit=None,restarts=None,seed=None,cache=None,
+          engine='cells',probe=False):
+    """Solve a nurikabe puzzle, printing solutions as they are found.
+    Variable island sizes range from 1 to maxvars, and are worked out
+    by the solver along with the rest of the board.
+    The solver uses jobs processes, and stops after limit solutions
+    if a limit is given.  If stats is given, the search is recorded in
+    it; with several jobs, only the part run in this process is.
+    branch and values name the branching strategy and value order
+    (see the branching module).
+    A serial search can be checkpointed to a file: every
+    CHECKPOINT_INTERVAL seconds, and when interrupted, which pauses the
+    search and raises KeyboardInterrupt.  The file is removed once the
+    search is over.  resume is a checkpoint to carry on from, and limit
+    counts the solutions found before it.
+    A serial search can be limited to timeout seconds and node_limit
+    search nodes, and restarted and randomized as Solver.iter_solutions.
+    Return the list of solutions and the solver's status, which is
+    'unknown' if the search was cut short by its limits (and then
+    checkpointed, if there is a checkpoint file).
+    If a cache.Cache is given, solutions are looked up there first, and
+    saved there after a search; the status of solutions found there is
+    'cached'.  engine names the board class, one of
+    board.ENGINES.  With probe, propagation also probes for failed
+    literals."""
+    b = parse_board(layout,engine=engine)
+    for letter in b.domains:
+        b.narrow_variable(letter,1,maxvars)
+    solutions = []
+    def show(s):
+        # solutions come in search order, so each gets its own sizes
+        if b.domains:
+            print assignment(layout,s)
+        print s
+        print
+        sys.stdout.flush()
+        solutions.append(s)
+
+    if cache and not resume:
+        found = cache.lookup(layout,maxvars,limit)
+        if found:
+            (cached,complete) = found
+            for s in cached[:limit]:
+                show(s)
+            return (solutions,'cached')
+
+    earlier = 0
+    if resume:
+        earlier = resume['solutions']
+    start = time.time()
+    sol = solver.Solver(b,stats,branching.brancher(branch,values),probe)
+    sol.timeout = timeout
+    sol.max_nodes = node_limit
+    if checkpoint:
+        handlers = _watch(sol,checkpoint)
+    try:
+        if earlier != limit:
+            for s in sol.iter_solutions(workers=jobs,resume=resume,
+                                        restarts=restarts,seed=seed):
+                show(s)
+                if earlier + len(solutions) == limit:
+                    break
+    finally:
+        if checkpoint:
+            _unwatch(handlers)
+    if checkpoint:
+        if sol.paused:
+            save_checkpoint(sol.paused,checkpoint)
+        elif os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    if sol.status == 'paused':
+        raise KeyboardInterrupt
+    if cache and not resume and (solutions or sol.status == 'complete'):
+        record = {'seconds':round(time.time() - start,6)}
+        if stats:
+            record.update(nodes=stats.nodes,backtracks=stats.backtracks)
+        cache.store(layout,maxvars,solutions,sol.status == 'complete',record)
+    return (solutions,sol.status)
+
+# seconds between checkpoints of a long search
+CHECKPOINT_INTERVAL = 60
+
+def save_checkpoint(data,path):
+    """Write a search checkpoint to a file, replacing it in one step."""
+    with open(path+'.tmp','w') as f:
+        json.dump(data,f)
+    os.rename(path+'.tmp',path)
+
+def _watch(sol,path):
+    """Checkpoint sol to path periodically, and pause it on SIGINT or
+    SIGTERM.  Return the old signal handlers."""
+    sol.on_checkpoint = lambda data: save_checkpoint(data,path)
+    def pause(signum,frame):
+        sol.pause()
+    def save(signum,frame):
+        sol.request_checkpoint()
+    handlers = {}
+    for (signum,handler) in [(signal.SIGINT,pause),(signal.SIGTERM,pause),
+                             (signal.SIGALRM,save)]:
+        handlers[signum] = signal.signal(signum,handler)
+    signal.setitimer(signal.ITIMER_REAL,CHECKPOINT_INTERVAL,
+                     CHECKPOINT_INTERVAL)
+    return handlers
+
+def _unwatch(handlers):
+    signal.setitimer(signal.ITIMER_REAL,0)
+    for (signum,handler) in handlers.items():
+        signal.signal(signum,handler)
 
 if __name__ == '__main__':
     import argparse
@@ -84,7 +192,53 @@ if __name__ == '__main__':
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('infile', nargs='?', type=argparse.FileType('r'),default=sys.stdin)
     parser.add_argument('-m', '--maxvars', type=int, default=9,
-                        help="Max value to try with variable islands.")
+                        help="Max size of variable islands.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of processes to solve with.")
+    parser.add_argument('-1', '--first', action='store_true',
+                        help="Stop after the first solution.")
+    parser.add_argument('-u', '--unique', action='store_true',
+                        help="Only check for a unique solution: stop after the second.")
+    parser.add_argument('-b', '--batch', nargs='+', metavar='PATH',
+                        help="Solve all puzzles in these files or directories, "
+                        "writing one JSON record per puzzle.")
+    parser.add_argument('--serve', nargs='?', type=int, const=client.DEFAULT_PORT,
+                        metavar='PORT',
+                        help="Run as a daemon, solving puzzles sent to PORT "
+                        "on localhost (see client.py).")
+    parser.add_argument('-o', '--out', type=argparse.FileType('w'), default=sys.stdout,
+                        help="Where to write batch results.")
+    parser.add_argument('-t', '--timeout', type=float,
+                        help="Seconds allowed for each puzzle.")
+    parser.add_argument('-n', '--node-limit', type=int,
+                        help="Search nodes allowed for each puzzle.")
+    parser.add_argument('--restarts', choices=sorted(solver.RESTARTS),
+                        help="Restart the search now and then, on this schedule.")
+    parser.add_argument('--seed', type=int,
+                        help="Break ties between nodes at random, with this seed.")
+    parser.add_argument('-c', '--checkpoint', metavar='FILE',
+                        help="Save the search in FILE now and then, and when "
+                        "interrupted.")
+    parser.add_argument('-r', '--resume', type=argparse.FileType('r'),
+                        metavar='FILE',
+                        help="Carry on a search from a checkpoint.")
+    parser.add_argument('--cache', metavar='DIR', default=cache.DEFAULT_PATH,
+                        help="Where to keep solutions of puzzles already solved.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always solve, without looking in or adding to the cache.")
+    parser.add_argument('--engine', choices=sorted(board.ENGINES),
+                        default='cells',
+                        help="Board engine: a node at a time, or bitmasks.")
+    parser.add_argument('-p', '--probe', action='store_true',
+                        help="Probe nodes for failed literals before branching.")
+    parser.add_argument('--branch', choices=sorted(branching.STRATEGIES),
+                        default='reach',
+                        help="How to choose nodes to branch on, when none is forced.")
+    parser.add_argument('--values', choices=sorted(branching.VALUES),
+                        default='water',
+                        help="Which value to try first when branching.")
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help="Report search statistics and time spent in checks.")
     parser.add_argument('-d', '--debug', dest='debug', action='store_true',
                     help="Turn on debug output.")
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
@@ -98,19 +252,96 @@ if __name__ == '__main__':
         log_level = logging.INFO
     logging.basicConfig(level=log_level)
 
+    limit = None
+    if args.first:
+        limit = 1
+    elif args.unique:
+        limit = 2
+
+    store = None
+    if not args.no_cache:
+        store = cache.Cache(args.cache)
+
+    if args.serve:
+        import server
+        server.serve(args.serve,args.jobs,maxvars=args.maxvars,limit=limit,
+                     timeout=args.timeout,timing=args.stats,
+                     branch=args.branch,values=args.values,
+                     node_limit=args.node_limit,restarts=args.restarts,
+                     seed=args.seed,cache=store,engine=args.engine,
+                     probe=args.probe)
+        sys.exit(0)
+
+    if args.batch:
+        import batch
+        start = time.time()
+        counts = batch.run(args.batch,out=args.out,jobs=args.jobs,
+                           maxvars=args.maxvars,limit=limit,timeout=args.timeout,
+                           timing=args.stats,branch=args.branch,
+                           values=args.values,node_limit=args.node_limit,
+                           restarts=args.restarts,seed=args.seed,
+                           cache=store,engine=args.engine,
+                           probe=args.probe)
+        summary = ', '.join(['%d %s' % (counts[k],k) for k in sorted(counts)])
+        sys.stderr.write('%s in %.2f seconds.\n' % (summary or 'No puzzles',
+                                                      time.time()-start))
+        sys.exit(0)
+
     layout = args.infile.read()
 
-    b = parse_board(layout)
+    b = parse_board(layout,engine=args.engine)
     print b
     print
 
+    st = None
+    if args.stats:
+        import stats
+        st = stats.Stats(timing=True)
+
+    resume = None
+    if args.resume:
+        resume = json.load(args.resume)
+    if args.jobs > 1 and (args.checkpoint or resume or args.timeout or
+                          args.node_limit or args.restarts):
+        parser.error('only a serial search can be checkpointed, '
+                     'restarted or limited')
+    if args.restarts and (args.checkpoint or resume):
+        parser.error('a restarting search cannot be checkpointed')
+
     start = time.time()
-    solutions = solve(layout,vals='123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'[:args.maxvars])
+    try:
+        (solutions,status) = solve(
+            layout,maxvars=args.maxvars,jobs=args.jobs,limit=limit,stats=st,
+            branch=args.branch,values=args.values,checkpoint=args.checkpoint,
+            resume=resume,timeout=args.timeout,node_limit=args.node_limit,
+            restarts=args.restarts,seed=args.seed,cache=store,
+            engine=args.engine,probe=args.probe)
+    except KeyboardInterrupt:
+        if args.checkpoint:
+            sys.exit('Search paused, resume with --resume %s' %
+                     args.checkpoint)
+        raise
     end = time.time()
 
+    count = len(solutions)
+    if resume:
+        count += resume['solutions']
     plural = 'solution'
-    if len(solutions) > 1:
+    if count > 1:
         plural += 's'
-    print len(solutions),plural,'found.'
+    print count,plural,'found.'
+    if status == 'unknown':
+        print 'Search limit reached, status unknown.'
+    if args.unique:
+        if count > 1:
+            print 'Solution is not unique.'
+        elif count == 1 and status != 'unknown':
+            print 'Solution is unique.'
     print end-start,'elapsed.'
+    if st and status == 'cached':
+        print
+        print 'Found in the cache, so there are no search statistics.'
+    elif st:
+        print
+        print st
     
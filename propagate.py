@@ -0,0 +1,456 @@
+"""
+propagate module
+   Deterministic deductions, applied to fixpoint before the solver
+   branches.  Every deduction is made with push_move, so it is undone
+   along with the branch that caused it.  Optionally, nodes are also
+   probed: each value is tried, with propagation, and taken back.
+
+2015 Bryan Clair
+"""
+
+import logging
+
+from squares import *
+
+_TYPES = {WATER:Water, LAND:Land}
+
+class Contradiction(Exception):
+    """The board cannot be completed."""
+    pass
+
+class Propagator:
+    """Apply the standard Nurikabe deduction rules to a board.
+
+    Each rule looks at the board and returns a list of (index, code)
+    pairs, all of which are forced by the current state.  Since the
+    board only fills up, a deduction stays true while rules run, so a
+    node forced both ways means a contradiction.
+    """
+    def __init__(self,board,check,probe=False):
+        """Propagate on board.  check(node) is called after each forced
+        move and must return False if the move broke the rules.
+        If probe is True, probe_rule runs when all the others stall."""
+        self.board = board
+        self.check = check
+        self.narrowed = False
+        self.probing = bool(probe)
+        self.trying = False     # inside a probe
+        self.ball = None
+
+        # cheap rules run every pass, costly ones only when cheap ones stall
+        self.rules = [self.islands_rule, self.pool_rule, self.variables_rule]
+        self.costly_rules = [self.water_exit_rule, self.reach_rule,
+                             self.cut_rule]
+
+    def run(self):
+        """Make forced moves until none remain.  Return the number of
+        moves pushed and whether the board is still consistent."""
+        self.pushed = 0
+        self.narrowed = False
+        # probes of this run: index -> height of the move stack when
+        # probed, and the height of the last move within two steps
+        self.probed = {}
+        self.touched = {}
+        self.seen = len(self.board.movestack)
+        try:
+            self._fixpoint(self.probing)
+        except Contradiction:
+            return (self.pushed,False)
+        return (self.pushed,True)
+
+    def _fixpoint(self,probe=False):
+        """Apply the rules until none makes progress, probing last."""
+        progress = True
+        while progress:
+            progress = False
+            for rule in self.rules:
+                if self._apply(rule()):
+                    progress = True
+            if progress:
+                continue
+            for rule in self.costly_rules:
+                if self._apply(rule()):
+                    progress = True
+                    break
+            if not progress and probe:
+                progress = self._apply(self.probe_rule())
+
+    def _apply(self,forced):
+        """Push the forced moves.  Return True if that, or narrowing a
+        variable size while finding them, changed anything."""
+        board = self.board
+        state = board.state
+        start = self.pushed
+        narrowed = self.narrowed
+        self.narrowed = False
+        for (i,code) in forced:
+            if state[i] == EMPTY:
+                node = board.nodes[i]
+                board.push_move(node,_TYPES[code]())
+                self.pushed += 1
+                if not self.check(node):
+                    raise Contradiction
+            elif state[i] != code:
+                raise Contradiction
+        if self.pushed > start:
+            logging.debug('Propagated %d nodes',self.pushed - start)
+        return narrowed or self.pushed > start
+
+    def _anchor(self,root):
+        """Return the index of the anchor of the island at root,
+        or None if it is unanchored."""
+        anchors = self.board.isle_anchors[root]
+        if not anchors:
+            return None
+        if len(anchors) > 1:
+            raise Contradiction
+        return anchors[0]
+
+    def _narrow(self,letter,lo=None,hi=None):
+        """Narrow a variable size, noting any change."""
+        board = self.board
+        old = board.domains[letter]
+        (lo,hi) = board.narrow_variable(letter,lo,hi)
+        if lo > hi:
+            raise Contradiction
+        if (lo,hi) != old:
+            self.narrowed = True
+
+    def _roots(self):
+        """Return list of the roots of all islands."""
+        board = self.board
+        state = board.state
+        roots = []
+        for i in range(len(state)):
+            if state[i] == LAND and board.isle_parent[i] == i:
+                roots.append(i)
+        return roots
+
+    def islands_rule(self):
+        """
+        * A complete island is surrounded by water.
+        * An incomplete island with one free neighbor must grow there.
+        * A node next to two anchored islands, or next to islands which
+          together would be too big, is water.
+        * An enclosed island with a variable size fixes that size.
+        """
+        board = self.board
+        forced = []
+        for root in self._roots():
+            size = board.isle_size[root]
+            frontier = board.isle_frontier[root]
+            anchor = self._anchor(root)
+            if anchor is None:
+                # unanchored land has to grow to find an anchor
+                if not frontier:
+                    raise Contradiction
+                if len(frontier) == 1:
+                    forced.extend([(n,LAND) for n in frontier])
+                continue
+
+            (lo,hi) = board.anchor_bounds(anchor)
+            if size > hi:
+                raise Contradiction
+            elif size == hi:
+                forced.extend([(n,WATER) for n in frontier])
+            elif not frontier:
+                if size < lo:
+                    raise Contradiction
+                self._narrow(board.variables[anchor],size,size)
+            elif len(frontier) == 1 and size < lo:
+                forced.extend([(n,LAND) for n in frontier])
+            else:
+                for n in frontier:
+                    total = 1
+                    anchored = 0
+                    for r in board.adjacent_islands(n):
+                        total += board.isle_size[r]
+                        if board.isle_anchors[r]:
+                            anchored += 1
+                    if anchored > 1 or total > hi:
+                        forced.append((n,WATER))
+        return forced
+
+    def variables_rule(self):
+        """
+        Bound variable island sizes.
+        * An island is at least as big as it is now.
+        * The islands together cover all the land, and no more than
+          the nodes that are not water.
+        """
+        board = self.board
+        if not board.domains:
+            return []
+
+        count = {}
+        for (a,letter) in board.variables.items():
+            size = board.isle_size[board.island_root(a)]
+            self._narrow(letter,lo=size)
+            count[letter] = count.get(letter,0) + 1
+
+        fixed = 0
+        for a in board.anchors:
+            fixed += board.size[board.index[a]]
+        room = len(board.nodes) - board.waters - fixed
+        land = room - board.state.count(bytearray([EMPTY]))
+        low = 0
+        high = 0
+        for (letter,m) in count.items():
+            (lo,hi) = board.domains[letter]
+            low += m*lo
+            high += m*hi
+        for (letter,m) in count.items():
+            (lo,hi) = board.domains[letter]
+            # room left for this letter's islands once others are minimal,
+            # and land left for them once others are maximal
+            self._narrow(letter,
+                         -((high - m*hi - land) // m),
+                         (room - (low - m*lo)) // m)
+        return []
+
+    def pool_rule(self):
+        """A pool that is all water but one node needs that node to be land."""
+        return [(n,LAND) for n in self.board.pool_gaps()]
+
+    def water_exit_rule(self):
+        """A body of water with a single exit must flow out through it,
+        unless it already holds all the water."""
+        forced = []
+        for exits in self.board.water_exits():
+            if not exits:
+                raise Contradiction
+            if len(exits) == 1:
+                forced.append((exits[0],WATER))
+        return forced
+
+    def cut_rule(self):
+        """
+        * An Empty node joining two parts of the wet region that both
+          hold water is water.
+        * An Empty node an island has to grow through, to reach its
+          size or land that only it can reach, is land.
+        """
+        board = self.board
+        return [(n,WATER) for n in board.water_cuts()] + \
+            [(n,LAND) for n in board.island_cuts()]
+
+    def reach_rule(self):
+        """Empty nodes no anchored island can grow to are water.
+        Unanchored land no anchored island can grow to is a contradiction."""
+        board = self.board
+        state = board.state
+        reached = set()
+        for a in board.anchors:
+            a = board.index[a]
+            reach = board.anchor_reach(a)
+            reached.update(reach)
+            if a in board.variables:
+                # an island can't outgrow the nodes it can reach
+                size = board.isle_size[board.island_root(a)]
+                self._narrow(board.variables[a],hi=size + len(reach))
+
+        forced = []
+        for i in range(len(state)):
+            if i in reached:
+                continue
+            if state[i] == EMPTY:
+                forced.append((i,WATER))
+            elif state[i] == LAND and not board.isle_anchors[
+                    board.island_root(i)]:
+                raise Contradiction
+        return forced
+
+    def probe_rule(self):
+        """
+        Failed literals.  Try both values at each Empty node next to an
+        island, propagating the other rules:
+        * A value that fails forces the other.
+        * A move both values force is forced.
+        Within a run, a node is probed again only after a move within
+        two steps of it.
+        """
+        board = self.board
+        moves = board.movestack
+        height = len(moves)
+        ball = self._balls()
+        for h in range(self.seen,height):
+            for j in ball[moves[h][0]]:
+                self.touched[j] = h
+        self.seen = height
+
+        for i in self._candidates():
+            if i in self.probed and self.touched.get(i,-1) < self.probed[i]:
+                continue
+            self.probed[i] = height
+            water = self._try(i,WATER)
+            land = self._try(i,LAND)
+            if water is None and land is None:
+                raise Contradiction
+            if water is None:
+                return [(i,LAND)]
+            if land is None:
+                return [(i,WATER)]
+            both = water & land
+            if both:
+                logging.debug('Probe at %s forces %d nodes',
+                              board.nodes[i],len(both))
+                return sorted(both)
+        return []
+
+    def _candidates(self):
+        """Return the Empty nodes to probe: next to islands, in index
+        order, then next to water."""
+        board = self.board
+        state = board.state
+        near = set()
+        for root in self._roots():
+            near.update(board.isle_frontier[root])
+        wet = set()
+        for i in range(len(state)):
+            if state[i] == WATER:
+                for n in board.nbrs[i]:
+                    if state[n] == EMPTY and n not in near:
+                        wet.add(n)
+        return sorted(near) + sorted(wet)
+
+    def _balls(self):
+        """Return, for each index, the indices within two steps of it."""
+        if self.ball is None:
+            nbrs = self.board.nbrs
+            self.ball = []
+            for i in range(len(nbrs)):
+                b = set([i])
+                for n in nbrs[i]:
+                    b.add(n)
+                    b.update(nbrs[n])
+                self.ball.append(tuple(b))
+        return self.ball
+
+    def _try(self,i,code):
+        """Make the move code at index i and propagate, then take it all
+        back.  Return the set of (index, code) moves that followed, or
+        None if the move fails."""
+        board = self.board
+        moves = board.movestack
+        height = len(moves)
+        saved = (self.pushed,self.narrowed)
+        self.trying = True
+        try:
+            node = board.nodes[i]
+            board.push_move(node,_TYPES[code]())
+            if not self.check(node):
+                return None
+            self._fixpoint()
+            state = board.state
+            return set([(m[0],state[m[0]]) for m in moves[height+1:]])
+        except Contradiction:
+            return None
+        finally:
+            while len(moves) > height:
+                board.pop_move()
+            (self.pushed,self.narrowed) = saved
+            self.trying = False
+
+if __name__=='__main__':
+    # Check propagation against brute force on small random boards:
+    # every move it forces must hold in every solution, and it may only
+    # find a contradiction on a board with no solutions.
+    import random
+    import board
+    import solver
+
+    def legal(b):
+        """True if the filled board b keeps the rules, checked from scratch."""
+        state = b.state
+        w = b.width
+        for i in range(len(state) - w):
+            if i % w < w - 1 and state[i] == state[i+1] == state[i+w] == \
+                    state[i+w+1] == WATER:
+                return False
+        waters = len([c for c in state if c == WATER])
+        seen = set()
+        for i in range(len(state)):
+            if i in seen:
+                continue
+            seen.add(i)
+            region = 0
+            anchors = []
+            stack = [i]
+            while stack:
+                j = stack.pop()
+                region += 1
+                if b.size[j]:
+                    anchors.append(b.size[j])
+                for n in b.nbrs[j]:
+                    if n not in seen and state[n] == state[i]:
+                        seen.add(n)
+                        stack.append(n)
+            if state[i] == WATER:
+                if region != waters:
+                    return False
+            elif anchors != [region]:
+                return False
+        return True
+
+    def solutions(b,empty):
+        """Return the states of b that fill the indices in empty legally."""
+        if not empty:
+            if legal(b):
+                return [bytearray(b.state)]
+            return []
+        found = []
+        for Type in (Water,Land):
+            b.push_move(b.nodes[empty[0]],Type())
+            found.extend(solutions(b,empty[1:]))
+            b.pop_move()
+        return found
+
+    random.seed(0)
+    counts = {'boards':0, 'solvable':0, 'forced':0, 'contradictions':0}
+    for trial in range(100):
+        # mostly boards with solutions
+        while True:
+            (w,h) = random.choice([(2,2),(3,2),(3,3),(4,2),(4,3),(3,4)])
+            b = board.BoardRectangle(w,h)
+            cells = list(b.nodes)
+            random.shuffle(cells)
+            for n in cells[:random.randint(1,3)]:
+                b.set_anchor(n,random.randint(1,4))
+            empty = [i for i in range(len(b.state)) if b.state[i] == EMPTY]
+            every = solutions(b,empty)
+            if every or random.random() < 0.1:
+                break
+
+        for k in range(5):
+            # part of a solution, or random moves
+            if every and k < 4:
+                fill = random.choice(every)
+            else:
+                fill = [random.choice([WATER,LAND]) for i in b.state]
+            for i in random.sample(empty,random.randint(0,len(empty))):
+                b.push_move(b.nodes[i],_TYPES[fill[i]]())
+            sols = [s for s in every
+                    if not [m for m in b.movestack if s[m[0]] != fill[m[0]]]]
+            counts['boards'] += 1
+            if sols:
+                counts['solvable'] += 1
+            for probe in (False,True):
+                moves = b.movestack
+                height = len(moves)
+                (pushed,ok) = solver.Solver(b,probe=probe).propagator.run()
+                if not ok:
+                    assert not sols,'false contradiction:\n%s' % b
+                    counts['contradictions'] += 1
+                for m in moves[height:]:
+                    for s in sols:
+                        assert s[m[0]] == b.state[m[0]], \
+                            'bad move at %s:\n%s' % (b.nodes[m[0]],b)
+                counts['forced'] += len(moves) - height
+                while len(moves) > height:
+                    b.pop_move()
+            while b.movestack:
+                b.pop_move()
+
+    print 'Checked %(boards)d boards, %(solvable)d with solutions:' % counts,
+    print '%(forced)d forced moves and %(contradictions)d contradictions' \
+        ' agree with brute force.' % counts
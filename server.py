@@ -0,0 +1,291 @@
+"""
+server module
+   A solver daemon.  Keeps a pool of worker processes, with the solver
+   already imported, and solves puzzles sent to it over HTTP on
+   localhost, answering with JSON records as batch does.
+
+   POST /solve           solve the puzzle in the body.  The query can
+                         give id, limit, maxvars, timeout, node_limit,
+                         branch, values, restarts, seed, engine and
+                         probe (0 or 1).
+   POST /cancel?id=ID    cancel a queued or running puzzle
+   GET /status           workers, and puzzles queued and running
+
+2015 Bryan Clair
+"""
+
+import BaseHTTPServer
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import Queue
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import urlparse
+
+import batch
+import board
+import branching
+import client
+import solver
+
+# request options, with their types and allowed values
+OPTIONS = {'id':(str,None), 'limit':(int,None), 'maxvars':(int,None),
+           'timeout':(float,None), 'node_limit':(int,None),
+           'branch':(str,branching.STRATEGIES),
+           'values':(str,branching.VALUES),
+           'restarts':(str,solver.RESTARTS), 'seed':(int,None),
+           'engine':(str,board.ENGINES), 'probe':(int,[0,1])}
+
+class Job(object):
+    """A puzzle sent to the daemon, and in the end its record."""
+    def __init__(self,number,layout,options):
+        self.number = number
+        self.layout = layout
+        self.id = options.pop('id',None) or str(number)
+        self.options = options
+        self.cancelled = False
+        self.record = None
+        self.done = threading.Event()
+
+def _work(conn,cancel):
+    """Solve jobs from conn until given None.  SIGUSR1 pauses the
+    search of the running job, if its number is cancel.value."""
+    running = [None,None]   # number and Solver of the running job
+    def stop(signum,frame):
+        if running[1] and running[0] == cancel.value:
+            running[1].pause()
+    def watch(s):
+        running[1] = s
+        # the signal may have come before there was a search to pause
+        if running[0] == cancel.value:
+            s.pause()
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1,stop)
+    signal.siginterrupt(signal.SIGUSR1,False)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        (number,layout,options) = job
+        running[0] = number
+        record = batch.solve_layout(layout,watch=watch,**options)
+        running[:] = [None,None]
+        conn.send(record)
+
+def _unsolved(status,**fields):
+    """Return the record of a puzzle the workers did not solve."""
+    record = {'status':status, 'solutions':0, 'grids':[],
+              'complete':False, 'wall':0.0, 'cpu':0.0}
+    record.update(fields)
+    return record
+
+class Worker(object):
+    """A solver process, and the thread handing it jobs from the queue."""
+    def __init__(self,server):
+        self.server = server
+        self.job = None
+        self.cancel = multiprocessing.Value('l',0)
+        self._spawn()
+
+    def _spawn(self):
+        (self.conn,child) = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work,
+                                               args=(child,self.cancel))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        server = self.server
+        while True:
+            job = server.queue.get()
+            if job is None:
+                return
+            with server.lock:
+                if job.cancelled:
+                    server.finish(job,_unsolved('cancelled'))
+                    continue
+                self.job = job
+            try:
+                self.conn.send((job.number,job.layout,job.options))
+                record = self.conn.recv()
+            except (EOFError,IOError) as e:
+                logging.warning('Worker %d died: %s',self.process.pid,e)
+                record = _unsolved('error',error='worker died')
+                self._spawn()
+            with server.lock:
+                self.job = None
+                server.finish(job,record)
+
+    def interrupt(self,job):
+        """Pause the search of job, which this worker is running."""
+        self.cancel.value = job.number
+        os.kill(self.process.pid,signal.SIGUSR1)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+class Server(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    """HTTP server feeding puzzles to jobs worker processes.
+    defaults are options of batch.solve_layout for every puzzle,
+    which requests can override."""
+    daemon_threads = True
+
+    def __init__(self,port=client.DEFAULT_PORT,jobs=1,defaults=None):
+        self.defaults = defaults or {}
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = {}              # id -> job, while queued or running
+        self.numbers = itertools.count(1)
+        self.served = 0
+        # fork the workers before there are threads or sockets to inherit
+        self.workers = [Worker(self) for j in range(jobs)]
+        for w in self.workers:
+            w.start()
+        BaseHTTPServer.HTTPServer.__init__(self,('127.0.0.1',port),Handler)
+
+    def submit(self,layout,options):
+        """Queue a puzzle, returning its Job."""
+        with self.lock:
+            opts = dict(self.defaults)
+            opts.update(options)
+            job = Job(next(self.numbers),layout,opts)
+            if job.id in self.jobs:
+                raise ValueError('Puzzle %s is already queued.' % job.id)
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def finish(self,job,record):
+        """Hand back the record of a job.  Call with the lock held."""
+        record['id'] = job.id
+        del self.jobs[job.id]
+        self.served += 1
+        job.record = record
+        job.done.set()
+
+    def cancel(self,id):
+        """Cancel a queued or running puzzle.  Return False if there is
+        no such puzzle."""
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None:
+                return False
+            job.cancelled = True
+            for w in self.workers:
+                if w.job is job:
+                    w.interrupt(job)
+            return True
+
+    def status(self):
+        with self.lock:
+            return {'workers':len(self.workers),
+                    'queued':len(self.jobs) - len([w for w in self.workers
+                                                   if w.job]),
+                    'running':sorted([w.job.id for w in self.workers
+                                      if w.job]),
+                    'served':self.served}
+
+    def handle_error(self,request,address):
+        if isinstance(sys.exc_info()[1],socket.error):
+            # the client stopped waiting, perhaps having cancelled
+            logging.info('Lost connection to %s',address[0])
+        else:
+            BaseHTTPServer.HTTPServer.handle_error(self,request,address)
+
+    def close(self):
+        """Stop the workers and the server."""
+        for w in self.workers:
+            self.queue.put(None)
+        for w in self.workers:
+            w.stop()
+        self.server_close()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers the requests of the module docstring."""
+    server_version = 'nurikabe/1'
+    protocol_version = 'HTTP/1.1'
+    # answers are small, and slow to send with Nagle on
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        (path,query) = self._parse()
+        if path == '/status':
+            self._reply(200,self.server.status())
+        else:
+            self._reply(404,{'status':'error','error':'No such page.'})
+
+    def do_POST(self):
+        (path,query) = self._parse()
+        body = self.rfile.read(int(self.headers.get('Content-Length',0)))
+        if path == '/solve':
+            try:
+                job = self.server.submit(body,self._options(query))
+            except ValueError as e:
+                self._reply(400,{'status':'error','error':str(e)})
+                return
+            # a timeout keeps the wait interruptible
+            job.done.wait(1e9)
+            self._reply(200,job.record)
+        elif path == '/cancel':
+            self._reply(200,{'cancelled':
+                             self.server.cancel(query.get('id',[''])[0])})
+        else:
+            self._reply(404,{'status':'error','error':'No such page.'})
+
+    def _parse(self):
+        """Return the path and query of the request."""
+        url = urlparse.urlparse(self.path)
+        return (url.path,urlparse.parse_qs(url.query))
+
+    def _options(self,query):
+        """Return the options of batch.solve_layout given in a query."""
+        options = {}
+        for (name,values) in query.items():
+            if name not in OPTIONS:
+                raise ValueError('Unknown option %s.' % name)
+            (kind,allowed) = OPTIONS[name]
+            value = kind(values[-1])
+            if allowed is not None and value not in allowed:
+                raise ValueError('Bad %s: %s.' % (name,value))
+            options[name] = value
+        return options
+
+    def _reply(self,code,data):
+        body = json.dumps(data,sort_keys=True) + '\n'
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        logging.info('%s ' + format,self.client_address[0],*args)
+
+def serve(port=client.DEFAULT_PORT,jobs=1,**defaults):
+    """Solve puzzles sent to port with jobs workers, until interrupted.
+    defaults are options of batch.solve_layout for every puzzle."""
+    server = Server(port,jobs,defaults)
+    def stop(signum,frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM,stop)
+    sys.stderr.write('Solving puzzles on http://127.0.0.1:%d/ with %d '
+                     'workers.\n' % (port,jobs))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -1,78 +1,202 @@
 """
 solver module
-   Implements recursive brute-force solution search.
+   Implements brute-force depth first solution search,
+   optionally split across a pool of processes, or paused and resumed.
 
 2015 Bryan Clair
 """
 
+import itertools
 import logging
+import multiprocessing
+import Queue
+import random
+import time
+import traceback
+from collections import OrderedDict
 
+import branching
 import graphutil
+import propagate
 from squares import *
 
+_TYPES = {WATER:Water, LAND:Land}
+
+# version of the checkpoint format
+CHECKPOINT_FORMAT = 3
+
+# search nodes in the shortest run between restarts
+RESTART_BASE = 100
+
+def luby(i):
+    """Return term i (from 1) of the Luby sequence 1,1,2,1,1,2,4,..."""
+    k = i.bit_length()
+    while i != (1 << k) - 1:
+        i -= (1 << (k - 1)) - 1
+        k = i.bit_length()
+    return 1 << (k - 1)
+
+def geometric(i):
+    """Return term i (from 1) of the run lengths 1,1,2,3,5,7,11,..."""
+    return int(1.5 ** (i - 1))
+
+# restart schedules, by name
+RESTARTS = {'luby':luby, 'geometric':geometric}
+
+# most board states remembered as having no solutions
+DEAD_STATES = 1 << 16
+
+# Parallel search.  The master expands the search tree to a fixed depth
+# and every node left at that depth becomes a task: the (index, code)
+# moves leading to it, the solver's list of good nodes and the ranges
+# of any variable island sizes.  Workers
+# explore a task for a limited number of nodes, then hand back what is
+# left as new tasks, so a lopsided subtree gets shared out.
+# The search is a function of the board state, so each task is explored
+# exactly as the serial solver would, and putting the pieces back
+# together in tree order gives the serial list of solutions.
+
+_worker = None
+
+def _init_worker(board,brancher,node_limit,probe):
+    global _worker
+    _worker = Solver(board,brancher=brancher,probe=probe)
+    _worker.node_limit = node_limit
+
+def _run_task(task):
+    """Explore a task in a worker.  Returns list of pieces, or a
+    traceback string if something went wrong."""
+    try:
+        return _worker.run_task(task)
+    except Exception:
+        return traceback.format_exc()
+
+class _Frame(object):
+    """A search node being branched on."""
+    __slots__ = ('node','values','tried','pushed','found','forced','key',
+                 'pieces','goodnodes')
+    def __init__(self,node,values,forced,key,goodnodes=()):
+        self.node = node
+        self.values = values    # types to try at node, in order
+        self.tried = 0          # how many of them have been tried
+        self.pushed = False     # is the move last tried on the board
+        self.found = False      # any solutions found below here
+        self.forced = forced    # moves forced on arriving here
+        self.key = key          # hash of the board on arriving here
+        self.pieces = None      # length of pieces on arriving here
+        self.goodnodes = tuple(goodnodes)   # forced nodes left after node
+
 class Solver:
-    def __init__(self,board):
+    def __init__(self,board,stats=None,brancher=None,probe=False):
+        """Solver for board.  If stats is given, the search is
+        recorded in it (see the stats module).  brancher is the
+        strategy for choosing nodes to branch on (see the branching
+        module), by default branching.Reach.  If probe is True,
+        propagation also probes nodes for failed literals."""
         self.board = board
         # set base node and successor dictionary for board traversal
-        self.basenode = board.graph.nodes()[0]
+        self.basenode = board.start_node()
         self.bfs_next = graphutil.bfs_list(board.graph,self.basenode)
+        self.propagator = propagate.Propagator(board,self.node_ok,probe)
+        self.brancher = brancher or branching.Reach()
+
+        self.stats = stats
+        if stats:
+            stats.instrument(self)
+
+        # Zobrist hashes of board states known to have no solutions,
+        # least recently used first.  A search tree never reaches the
+        # same state twice, but a solver searching again (in a worker,
+        # or after a restart) can skip what it already ruled out.
+        self.dead = OrderedDict()
+        self.dead_limit = DEAD_STATES
+        self.dead_domains = None
+
+        # path to the current search node, and pausing state
+        self.stack = []
+        self.found = 0
+        self.pausing = False
+        self.paused = None
+        self.saving = False
+        self.on_checkpoint = None
+
+        # search budget: most search nodes and seconds, None for no limit.
+        # status says how the last search ended: 'complete', 'unknown'
+        # if it ran out of budget or 'paused'.
+        self.max_nodes = None
+        self.timeout = None
+        self.deadline = None
+        self.node_cap = None
+        self.status = None
+
+        # search splitting state, only used for parallel solves
+        self.pieces = None
+        self.split_depth = None
+        self.node_limit = None
 
     def node_ok(self,node):
         """Check if newly placed node is legal."""
         if self.board.is_Land(node):
             if not self.board.legal_island(node):
-                logging.debug('land at '+str(node)+' makes bad island')
+                logging.debug('land at %s makes bad island',node)
+                self._prune('bad island')
                 return False
         else: # Water node
             if self.board.in_pool(node):
-                logging.debug('water at '+str(node)+' makes pool')
+                logging.debug('water at %s makes pool',node)
+                self._prune('pool')
                 return False
-            for n in self.board.graph[node]:
-                if self.board.is_Land(n) and not self.board.legal_island(n):
-                    logging.debug('water at' + str(node) +
-                                  ' constricts island at '+str(n))
+            board = self.board
+            for i in board.nbrs[board.index[node]]:
+                if board.state[i] == LAND and \
+                        not board.legal_island(board.nodes[i]):
+                    logging.debug('water at %s constricts island at %s',
+                                  node,board.nodes[i])
+                    self._prune('constricted island')
                     return False
         # Check for connected water
         if not self.board.connected_water():
-            logging.debug('node at '+str(node)+' disconnects water')
+            logging.debug('node at %s disconnects water',node)
+            self._prune('disconnected water')
             return False
         
         return True
 
+    def _prune(self,reason):
+        # moves tried by a probe are not part of the search
+        if self.stats and not self.propagator.trying:
+            self.stats.prune(reason)
+
     def _scan_islands(self):
         """
         Look for nodes next to islands:
-        Return a list of all forced nodes.
+        Return a list of all forced nodes, the most pressing last.
 
         Forced nodes:
         * If island is full, all free adjacent nodes
         * If island has only one free adjacent node, and it's hungry
         * If two islands share a free adjacent node
+
+        The board keeps each island's forced nodes from one scan to the
+        next, only looking again at islands whose frontier has changed
+        (see Board.island_forced).
         """
         # interesting note: I tried to make this smarter. When there are
         # no forced nodes, why not try to use some node that's next to an
         # island? That seems reasonable, but is much much slower than just
         # fallback to breadth-first search
-        found = []
-        fans = []
-        for anchor in self.board.anchors:
-            (size, freedoms, a) = self.board.explore_island(anchor)
-            if size == self.board.get_node(anchor).size:
-                found.extend(freedoms)
-            elif len(freedoms) == 1:
-                found.extend(freedoms)
-            else:
-                found.extend(set(freedoms).intersection(fans))
-            fans.extend(freedoms)
-
+        nodes = self.board.nodes
+        found = [nodes[i] for i in self.board.forced_frontier()]
         if found:
-            logging.debug('Found nodes to work on:'+str(found))
+            logging.debug('Found nodes to work on: %s',found)
         return found
 
     def _find_good_node_to_work_on(self):
         while self.goodnodes:
             node = self.goodnodes.pop()
             if self.board.is_Empty(node):
+                if self.stats:
+                    self.stats.forced_choices += 1
                 return node
 
         self.goodnodes = self._scan_islands()
@@ -80,58 +204,435 @@ class Solver:
         while self.goodnodes:
             node = self.goodnodes.pop()
             if self.board.is_Empty(node):
+                if self.stats:
+                    self.stats.forced_choices += 1
                 return node
 
-        # Find an empty node in BFS order
-        node = self.basenode
-        while node and not self.board.is_Empty(node):
-            node = self.bfs_next[node]
+        # Nothing forced, so the branching strategy decides
+        node = self.brancher.choose(self)
+        if self.stats and node is not None:
+            self.stats.fallback_choices += 1
         return node
 
-    def _solve(self):
+    def _enter(self,propagate=True):
         """
-        Brute force recursive solver.
+        Start a level of the search at the current board state: make
+        all forced moves, then pick an empty node to branch on.
+        Return (frame,solution).  frame is a _Frame for the node, or
+        None if the level is already over, in which case any forced
+        moves have been undone.  solution is the board, if it is solved.
         """
-        solutions = []
-        logging.debug('\n'+str(self.board))
+        board = self.board
+        key = None
+        forced = 0
+        if propagate:
+            key = board.zhash
+            if key in self.dead:
+                # touch the entry, so it is the last to be forgotten
+                self.dead[key] = self.dead.pop(key)
+                if self.stats:
+                    self.stats.backtracks += 1
+                    self.stats.prune('dead state')
+                return (None,None)
+            (forced,ok) = self.propagator.run()
+            if not ok:
+                self._pop_moves(forced)
+                self._bury(key)
+                if self.stats:
+                    self.stats.backtracks += 1
+                    self.stats.prune('propagation')
+                return (None,None)
+
+        if self.pieces is not None and self._split_here():
+            self.pieces.append(self._task())
+            self._pop_moves(forced)
+            return (None,None)
+
+        self.search_nodes += 1
+        stats = self.stats
+        if stats:
+            stats.nodes += 1
+            if self.depth > stats.max_depth:
+                stats.max_depth = self.depth
+        logging.debug('\n%s',self.board)
 
         node = self._find_good_node_to_work_on()
 
         # All nodes full? Solved
         if node == None:
-            return [str(self.board)]
+            solution = str(self.board)
+            self._pop_moves(forced)
+            return (None,solution)
 
-        logging.debug('Working node '+str(node))
+        logging.debug('Working node %s',node)
+        frame = _Frame(node,self.brancher.order(node),forced,key,
+                       self.goodnodes)
+        if self.pieces is not None:
+            frame.pieces = len(self.pieces)
+        return (frame,None)
 
-        # Recurse on empty node
-        for Type in [Water, Land]:
-            assert(self.board.is_Empty(node))
-            self.board.push_move(node,Type())
+    def _leave(self,frame):
+        """Finish the level of the search frame was made for."""
+        self._pop_moves(frame.forced)
+        # a subtree left as a task is not known to be dead
+        if frame.key is not None and not frame.found and \
+                (self.pieces is None or len(self.pieces) == frame.pieces):
+            self._bury(frame.key)
 
-            if self.node_ok(node):
-                logging.debug('Node '+str(node)+' set to '+Type.__name__)
-                solutions.extend(self._solve())
+    def _pop_moves(self,count):
+        for i in range(count):
+            self.board.pop_move()
+
+    def _search(self,propagate=True,resume=None):
+        """
+        Depth first search from the current board state, generating
+        solutions.  The path to the current search node is kept in
+        self.stack, one _Frame for each node branched on, so the search
+        can be paused and saved (see checkpoint).  If propagate is
+        False, the board is taken to be propagated already.  resume is
+        a checkpoint to carry on from.
+        """
+        board = self.board
+        stack = self.stack = []
+        self.paused = None
+        self.status = None
+        self.search_nodes = 0
+        self.root_hash = board.zhash
+        self.root_domains = sorted(board.domains.items())
+        try:
+            if resume is not None:
+                self._replay(resume)
             else:
-                logging.debug('Node '+str(node)+' cannot be '+Type.__name__)
+                self.found = 0
+                self.depth = 0
+                (frame,solution) = self._enter(propagate)
+                if solution is not None:
+                    self.found += 1
+                    yield solution
+                if frame:
+                    stack.append(frame)
 
-            self.board.pop_move()
+            while stack:
+                if self.pausing or self._out_of_budget():
+                    if self.pausing:
+                        self.status = 'paused'
+                        self.pausing = False
+                    else:
+                        self.status = 'unknown'
+                    self.paused = self.checkpoint()
+                    return
+                if self.saving:
+                    self.saving = False
+                    self.on_checkpoint(self.checkpoint())
+                frame = stack[-1]
+                if frame.pushed:
+                    board.pop_move()
+                    frame.pushed = False
+
+                if frame.tried == len(frame.values):
+                    # both values done, back up a level
+                    stack.pop()
+                    self._leave(frame)
+                    if stack:
+                        if frame.found:
+                            stack[-1].found = True
+                        else:
+                            self.brancher.failed(self,stack[-1].node)
+                    continue
+
+                node = frame.node
+                Type = frame.values[frame.tried]
+                frame.tried += 1
+                # what was forced below an earlier value may not be now
+                self.goodnodes = list(frame.goodnodes)
+                assert(board.is_Empty(node))
+                board.push_move(node,Type())
+                frame.pushed = True
+                if not self.node_ok(node):
+                    self.brancher.failed(self,node)
+                    if self.stats:
+                        self.stats.backtracks += 1
+                    logging.debug('Node %s cannot be %s',node,Type.__name__)
+                    continue
+
+                logging.debug('Node %s set to %s',node,Type.__name__)
+                self.depth = len(stack)
+                (child,solution) = self._enter()
+                if child:
+                    stack.append(child)
+                elif solution is not None:
+                    frame.found = True
+                    self.found += 1
+                    yield solution
+                else:
+                    self.brancher.failed(self,node)
+            self.status = 'complete'
+        finally:
+            self._unwind()
+
+    def _out_of_budget(self):
+        if self.node_cap is not None and self.search_nodes >= self.node_cap:
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def _unwind(self):
+        """Undo the moves of every level of the search."""
+        stack = self.stack
+        while stack:
+            frame = stack.pop()
+            if frame.pushed:
+                self.board.pop_move()
+            self._pop_moves(frame.forced)
+
+    def pause(self):
+        """Ask a search to stop at the next search node, or at its
+        first if it has yet to start.  The generator then ends, leaving
+        a checkpoint in self.paused."""
+        self.pausing = True
+
+    def request_checkpoint(self):
+        """Ask a running search to pass a checkpoint to on_checkpoint
+        at the next search node, and carry on.  Safe to call from a
+        signal handler."""
+        self.saving = self.on_checkpoint is not None
+
+    def checkpoint(self):
+        """
+        Return a checkpoint of the search, from which resume can carry
+        it on later.  It can be taken while the solution generator is
+        waiting, or is saved in self.paused by pause.  A checkpoint is
+        made of lists, numbers and strings, so it can be saved as JSON.
+        Learned branching weights and dead states are not kept.
+        """
+        index = self.board.index
+        return {'format':CHECKPOINT_FORMAT, 'root':self.root_hash,
+                'domains':self.root_domains, 'solutions':self.found,
+                'probe':self.propagator.probing,
+                'frames':[[index[f.node],[T.code for T in f.values],
+                           f.tried,f.pushed,f.found,
+                           [index[n] for n in f.goodnodes]]
+                          for f in self.stack]}
+
+    def _replay(self,checkpoint):
+        """Rebuild the search path saved in a checkpoint."""
+        board = self.board
+        if checkpoint.get('format') != CHECKPOINT_FORMAT or \
+                checkpoint['root'] != self.root_hash or \
+                [(letter,tuple(r)) for (letter,r) in checkpoint['domains']] \
+                != self.root_domains:
+            raise ValueError('checkpoint is not for this board')
+        if checkpoint.get('probe',False) != self.propagator.probing:
+            raise ValueError('checkpoint was made with probing %s' %
+                             ('on' if checkpoint.get('probe') else 'off'))
+        self.found = checkpoint['solutions']
+        for (i,codes,tried,pushed,found,goodnodes) in checkpoint['frames']:
+            # the forced moves at a level follow from the moves before
+            key = board.zhash
+            (forced,ok) = self.propagator.run()
+            frame = _Frame(board.nodes[i],[_TYPES[c] for c in codes],
+                           forced,key,[board.nodes[g] for g in goodnodes])
+            self.stack.append(frame)
+            (frame.tried,frame.found) = (tried,found)
+            if not ok:
+                raise ValueError('checkpoint does not fit the board')
+            if pushed:
+                board.push_move(frame.node,frame.values[tried-1]())
+                frame.pushed = True
 
-        return solutions
+    def _bury(self,key):
+        """Remember that the state with hash key has no solutions."""
+        dead = self.dead
+        dead[key] = True
+        if len(dead) > self.dead_limit:
+            dead.popitem(last=False)
 
-    def solve(self):
+    def _split_here(self):
+        """True if the search should stop here and leave a task behind."""
+        if self.split_depth is not None and self.depth >= self.split_depth:
+            return True
+        if self.nodes_left is not None:
+            if self.nodes_left <= 0:
+                return True
+            self.nodes_left -= 1
+        return False
+
+    def _task(self):
+        """Return a task describing the current search node."""
+        state = self.board.state
+        moves = self.board.movestack[self.base_height:]
+        return (tuple([(m[0],state[m[0]]) for m in moves]),
+                tuple(self.goodnodes),
+                tuple(sorted(self.board.domains.items())))
+
+    def run_task(self,task):
+        """Explore a task for up to node_limit nodes.  Return the
+        solutions found and tasks left over, in search order."""
+        (moves,goodnodes,domains) = task
+        board = self.board
+        self.base_height = len(board.movestack)
+        for (i,code) in moves:
+            board.push_move(board.nodes[i],_TYPES[code]())
+        for (letter,(lo,hi)) in domains:
+            board.narrow_variable(letter,lo,hi)
+        self.goodnodes = list(goodnodes)
+        self.depth = 0
+        self.nodes_left = self.node_limit
+        self.pieces = []
+        try:
+            for s in self._search(propagate=False):
+                self.pieces.append(s)
+        finally:
+            for m in moves:
+                board.pop_move()
+        (pieces,self.pieces) = (self.pieces,None)
+        return pieces
+
+    def iter_solutions(self,workers=1,split_depth=None,node_limit=1000,
+                       resume=None,restarts=None,seed=None):
         """
-        Find all solutions to the board in its current state,
-        return them as list.
+        Generate the solutions to the board in its current state.
+        The board is back in its starting state once the generator
+        is exhausted or closed.
+        With more than one worker, the search is split across that many
+        processes.  The first split_depth levels of the search tree are
+        expanded before handing out tasks (by default, enough to give
+        each worker several), and workers hand back what is left of a
+        task after node_limit nodes.  Solutions come out in the same
+        order as from a serial solve, unless the branching strategy
+        learns from the search.
+        A serial search can carry on from a checkpoint given as resume,
+        generating the solutions it had yet to find.
+        A serial search stops once it has used max_nodes search nodes or
+        timeout seconds, if they are set, with status 'unknown'.  It can
+        also restart now and then, following a schedule named in
+        RESTARTS.  With a seed, ties between nodes to branch on are
+        broken at random (always, when restarting).
         """
         self.goodnodes = []
-        return self._solve()
+        self.depth = 0
+        # states found dead under other variable size ranges may not be
+        if self.dead_domains != self.board.domains:
+            self.dead.clear()
+            self.dead_domains = dict(self.board.domains)
+        if seed is not None or restarts:
+            self.brancher.rng = random.Random(seed or 0)
+        if workers <= 1:
+            self.deadline = None
+            if self.timeout is not None:
+                self.deadline = time.time() + self.timeout
+            if restarts:
+                search = self._restart_search(RESTARTS[restarts])
+            else:
+                self.node_cap = self.max_nodes
+                search = self._search(resume=resume)
+            for s in search:
+                yield s
+            return
+        if resume is not None or restarts or self.max_nodes or self.timeout:
+            raise ValueError('only a serial search can be resumed, '
+                             'restarted or limited')
+
+        if split_depth is None:
+            split_depth = (4*workers - 1).bit_length()
+        self.status = None
+        self.base_height = len(self.board.movestack)
+        self.split_depth = split_depth
+        self.nodes_left = None
+        self.pieces = []
+        try:
+            for s in self._search():
+                self.pieces.append(s)
+            root = self.pieces
+        finally:
+            self.pieces = None
+            self.split_depth = None
+        for s in self._solve_tasks(root,workers,node_limit):
+            yield s
+        self.status = 'complete'
+
+    def _restart_search(self,schedule):
+        """Search in runs of RESTART_BASE times schedule(run) nodes,
+        starting over after each, until a run finishes or the budget is
+        used up.  Each solution is generated once."""
+        seen = set()
+        used = 0
+        for run in itertools.count(1):
+            self.node_cap = RESTART_BASE * schedule(run)
+            if self.max_nodes is not None:
+                self.node_cap = min(self.node_cap,self.max_nodes - used)
+            self.goodnodes = []
+            for s in self._search():
+                if s not in seen:
+                    seen.add(s)
+                    yield s
+            used += self.search_nodes
+            if self.status != 'unknown':
+                return
+            if (self.deadline is not None and time.time() >= self.deadline) \
+                    or used == self.max_nodes:
+                return
+            logging.info('Restarting after %d nodes',used)
+            if self.stats:
+                self.stats.restarts += 1
+
+    def solve(self,limit=None,**kwargs):
+        """
+        Find solutions to the board in its current state,
+        return them as list.  Stop after limit solutions, if given.
+        Other arguments are as for iter_solutions.
+        """
+        return list(itertools.islice(self.iter_solutions(**kwargs),limit))
+
+    def _solve_tasks(self,root,workers,node_limit):
+        """Run the tasks among root through a process pool, along with
+        any tasks they leave over.  Generate solutions in search order,
+        each as soon as everything before it in the search is done."""
+        results = {}
+        done = Queue.Queue()
+        pool = multiprocessing.Pool(workers,_init_worker,
+                                    (self.board,self.brancher,node_limit,
+                                     self.propagator.probing))
+
+        def submit(pieces):
+            # replace each task with a key and send it to the pool
+            for (k,p) in enumerate(pieces):
+                if isinstance(p,str):
+                    continue
+                key = len(results)
+                results[key] = None
+                pieces[k] = key
+                pool.apply_async(_run_task,(p,),
+                                 callback=lambda r,key=key: done.put((key,r)))
+
+        try:
+            submit(root)
+            # walk the pieces in search order, waiting for tasks as needed
+            stack = [iter(root)]
+            while stack:
+                for p in stack[-1]:
+                    if isinstance(p,str):
+                        yield p
+                        continue
+                    while results[p] is None:
+                        (key,pieces) = done.get()
+                        if isinstance(pieces,str):
+                            raise RuntimeError('worker failed:\n'+pieces)
+                        submit(pieces)
+                        results[key] = pieces
+                    stack.append(iter(results[p]))
+                    break
+                else:
+                    stack.pop()
+        finally:
+            pool.terminate()
+            pool.join()
 
 if __name__=='__main__':
     logging.basicConfig(level=logging.DEBUG)
-    import board
+    import nurikabe
 
     def doboard(s):
-        b = board.BoardFromASCII(s)
+        b = nurikabe.parse_board(s)
         print b
         print 'Solutions:'
         answers = Solver(b).solve()
@@ -163,4 +664,18 @@ if __name__=='__main__':
     print 'Board with six solutions'
     doboard('3...\n....\n...3')
 
-
+    # A parallel solve must give the solutions in serial order, also when
+    # variable sizes are narrowed and widened again by backtracking.
+    logging.getLogger().setLevel(logging.WARNING)
+    for layout in ['a...\n....\n....\nb...',
+                   '.a...\n.....\n..b..\n.....\n...a.']:
+        b = nurikabe.parse_board(layout)
+        for letter in b.domains:
+            b.narrow_variable(letter,1,6)
+        serial = Solver(b).solve()
+        for depth in [1,2,3]:
+            assert Solver(b).solve(workers=2,split_depth=depth,
+                                   node_limit=1) == serial, \
+                'parallel order differs, split at depth %d:\n%s' % (depth,b)
+        print 'Board with %d solutions in serial order from 2 workers' % \
+            len(serial)
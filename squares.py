@@ -1,37 +1,42 @@
 """
 square module
-  Each node of the board contains a Square subclass.
+  Describes the value of a node of the board.
+  The board itself stores only the integer codes below; Square
+  subclasses are used to pass values in and out of the board.
   Only when using square grids do these actually correspond to anything square.
 
 2015 Bryan Clair
 """
+
+# state codes used by the board's compact storage
+EMPTY = 0
+WATER = 1
+LAND = 2
+
 class Square:
     """One square of the board."""
-    theMark = 0
-    @staticmethod
-    def clear_marks():
-        Square.theMark += 1
-    def __init__(self):
-        self.marker = None
-    def mark(self):
-        self.marker = Square.theMark
-    def marked(self):
-        return self.marker == Square.theMark
+    code = None
 
 class Empty(Square):
+    code = EMPTY
     def __str__(self):
         return '.'
 class Water(Square):
+    code = WATER
     def __str__(self):
         return '#'
 class Land(Square):
+    code = LAND
     def __str__(self):
         return '+'
 class Anchor(Land):
-    def __init__(self,size):
-        Land.__init__(self)
+    def __init__(self,size,lo=None,hi=None):
+        """An anchor of given size.  The size may be a letter, naming a
+        variable size which is known to be between lo and hi."""
         assert size > 0
         self.size = size
+        self.lo = lo
+        self.hi = hi
     def __str__(self):
         if isinstance(self.size,str) and self.size.islower():
             # it's an uninstantiated variable island size. Print it as a letter
@@ -40,4 +45,3 @@ class Anchor(Land):
             return str(self.size)
         else:
             return chr(self.size - 10 + ord('A'))
-
@@ -0,0 +1,86 @@
+"""
+stats module
+   Counters and timers describing a search.
+
+2015 Bryan Clair
+"""
+
+import time
+
+class Stats:
+    """Statistics gathered by a Solver.
+
+    The solver only updates a Stats object if it was given one, so a
+    plain solve pays nothing.  With timing on, instrument() also wraps
+    the board checks and solver scans to count their calls and time
+    them, which does slow the search somewhat.
+    """
+    def __init__(self,timing=False):
+        self.timing = timing
+        self.nodes = 0              # search nodes expanded
+        self.max_depth = 0          # deepest branch
+        self.backtracks = 0         # dead ends found
+        self.restarts = 0           # times the search started over
+        self.forced_choices = 0     # branches on nodes next to islands
+        self.fallback_choices = 0   # branches on nodes found by BFS
+        self.prunes = {}            # reason -> count of rejected moves
+        self.calls = {}             # function -> count of calls
+        self.times = {}             # function -> seconds spent
+
+    def prune(self,reason):
+        """Count a move rejected for reason."""
+        self.prunes[reason] = self.prunes.get(reason,0) + 1
+
+    def _wrap(self,obj,name,label=None):
+        """Replace method name of obj by one that is counted and timed,
+        reported under label (by default the method name)."""
+        method = getattr(obj,name)
+        calls = self.calls
+        times = self.times
+        label = label or name
+        calls[label] = 0
+        times[label] = 0.0
+        clock = time.time
+        def timed(*args):
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                times[label] += clock() - start
+                calls[label] += 1
+        setattr(obj,name,timed)
+
+    def instrument(self,solver):
+        """Wrap the solver's checks with timers, if timing is on."""
+        if not self.timing:
+            return
+        # explore_island is only called by legal_island, whose time
+        # covers it (board.island_explorations counts its calls)
+        for name in ['legal_island','in_pool','connected_water']:
+            self._wrap(solver.board,name)
+        self._wrap(solver,'_scan_islands')
+        self._wrap(solver.propagator,'run','propagate')
+        if solver.propagator.probing:
+            self._wrap(solver.propagator,'probe_rule','probe')
+
+    def as_dict(self):
+        """Return the statistics as a dictionary."""
+        d = dict(self.__dict__)
+        del d['timing']
+        return d
+
+    def __str__(self):
+        out = 'Search nodes: %d (max depth %d)\n' % (self.nodes,self.max_depth)
+        out += 'Branch choices: %d forced, %d fallback\n' % (
+            self.forced_choices,self.fallback_choices)
+        out += 'Backtracks: %d\n' % self.backtracks
+        if self.restarts:
+            out += 'Restarts: %d\n' % self.restarts
+        for (reason,count) in sorted(self.prunes.items()):
+            out += '  %-20s %8d\n' % (reason,count)
+        if self.calls:
+            out += 'Function                 calls  seconds\n'
+            for name in sorted(self.calls):
+                out += '  %-20s %8d %8.3f\n' % (name,self.calls[name],
+                                                self.times[name])
+        return out.rstrip('\n')
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+"""
+Nurikabe solution verifier
+2015 Bryan Clair
+
+Checks finished boards against the rules of Nurikabe, many at once.
+Boards of the same size are stacked into NumPy arrays and checked
+together: pools with 2x2 windows, islands and water by labeling the
+connected regions of every board in one pass.  Requires numpy.
+
+Pass files of boards, in the ASCII form nurikabe.py reads, separated
+by blank lines, or give them on stdin.  Prints one verdict per board:
+ok, or the first rule it breaks.
+"""
+
+import sys
+
+import numpy as np
+
+from squares import *
+
+# verdicts, by code
+REASONS = ['ok', 'incomplete', 'pool', 'two anchors', 'unanchored island',
+           'island size', 'variable sizes', 'disconnected water']
+(OK, INCOMPLETE, POOL, TWO_ANCHORS, UNANCHORED, ISLAND_SIZE, VARIABLES,
+ DISCONNECTED) = range(len(REASONS))
+
+# character -> state, anchor size and variable letter (1 for a, ...)
+_STATE = np.zeros(256,np.int8) - 1
+_SIZE = np.zeros(256,np.int32)
+_LETTER = np.zeros(256,np.int32)
+_STATE[ord('.')] = EMPTY
+_STATE[ord('#')] = WATER
+_STATE[ord('+')] = LAND
+for (k,c) in enumerate('123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
+    _STATE[ord(c)] = LAND
+    _SIZE[ord(c)] = k + 1
+for (k,c) in enumerate('abcdefghijklmnopqrstuvwxyz'):
+    _STATE[ord(c)] = LAND
+    _LETTER[ord(c)] = k + 1
+
+def parse(boards):
+    """Return boards of the same size, each given as text (rows split
+    by whitespace, as for nurikabe.parse_board) or as a list of rows,
+    as arrays (state, size, letter) of shape (count, height, width).
+    size holds anchor sizes and letter variable letters, 0 elsewhere."""
+    rows = [b.split() if isinstance(b,str) else b for b in boards]
+    if not rows:
+        raise ValueError('No boards.')
+    shape = (len(rows),len(rows[0]),len(rows[0][0]))
+    for r in rows:
+        if len(r) != shape[1] or [x for x in r if len(x) != shape[2]]:
+            raise ValueError('All boards must be the same size.')
+    chars = np.frombuffer(''.join([''.join(r) for r in rows]),np.uint8)
+    chars = chars.reshape(shape)
+    state = _STATE[chars]
+    if (state < 0).any():
+        raise ValueError("Bad character: '%s'" % chr(chars[state < 0][0]))
+    return (state,_SIZE[chars],_LETTER[chars])
+
+def label(state):
+    """Return labels of the regions of each board, where a region is
+    connected nodes of the same state.  Each node is labeled with the
+    least flat index of its region, counting over the whole stack."""
+    across = state[:,:,1:] == state[:,:,:-1]
+    down = state[:,1:,:] == state[:,:-1,:]
+    lab = np.arange(state.size).reshape(state.shape)
+    while True:
+        new = lab.copy()
+        # pull the smaller label over every edge inside a region
+        m = np.minimum(lab[:,:,1:],lab[:,:,:-1])
+        new[:,:,1:] = np.where(across,np.minimum(new[:,:,1:],m),new[:,:,1:])
+        new[:,:,:-1] = np.where(across,np.minimum(new[:,:,:-1],m),
+                                new[:,:,:-1])
+        m = np.minimum(lab[:,1:,:],lab[:,:-1,:])
+        new[:,1:,:] = np.where(down,np.minimum(new[:,1:,:],m),new[:,1:,:])
+        new[:,:-1,:] = np.where(down,np.minimum(new[:,:-1,:],m),
+                                new[:,:-1,:])
+        # a label names a node of the same region, so take its label too
+        flat = new.ravel()
+        new = flat[flat].reshape(state.shape)
+        if np.array_equal(new,lab):
+            return lab
+        lab = new
+
+def verify(state,size,letter,maxvars=None):
+    """Return an array of verdict codes (see REASONS), one for each
+    board of the stack given as by parse.  Islands with the same
+    variable letter must be the same size, at most maxvars if given."""
+    (count,height,width) = state.shape
+    nodes = height*width
+    verdict = np.zeros(count,np.int8)
+    def fail(bad,code):
+        verdict[(verdict == OK) & bad] = code
+    def boards(bad):
+        # boards holding any of the flat indices set in bad
+        return np.bincount(np.flatnonzero(bad) // nodes,
+                           minlength=count) > 0
+
+    fail((state == EMPTY).reshape(count,-1).any(axis=1),INCOMPLETE)
+    water = state == WATER
+    pools = water[:,1:,1:] & water[:,1:,:-1] & water[:,:-1,1:] & \
+        water[:,:-1,:-1]
+    fail(pools.reshape(count,-1).any(axis=1),POOL)
+
+    lab = label(state).ravel()
+    roots = lab == np.arange(lab.size)
+    land = (state == LAND).ravel()
+    size = size.ravel()
+    letter = letter.ravel()
+    anchor = land & ((size > 0) | (letter > 0))
+
+    # for each island, by root: its size, anchors, and their size and letter
+    area = np.bincount(lab[land],minlength=lab.size)
+    anchors = np.bincount(lab[anchor],minlength=lab.size)
+    want = np.bincount(lab[anchor],size[anchor],minlength=lab.size)
+    name = np.bincount(lab[anchor],letter[anchor],minlength=lab.size)
+    islands = land & roots
+    fail(boards(islands & (anchors > 1)),TWO_ANCHORS)
+    fail(boards(islands & (anchors == 0)),UNANCHORED)
+    single = islands & (anchors == 1)
+    fail(boards(single & (want > 0) & (area != want)),ISLAND_SIZE)
+
+    # islands of each variable letter in a board must match
+    var = np.flatnonzero(single & (name > 0))
+    if len(var):
+        key = (var // nodes)*27 + name[var].astype(int)
+        lo = np.zeros(count*27,int) + nodes + 1
+        hi = np.zeros(count*27,int)
+        np.minimum.at(lo,key,area[var])
+        np.maximum.at(hi,key,area[var])
+        bad = (hi > 0) & (lo != hi)
+        if maxvars is not None:
+            bad |= hi > maxvars
+        fail(np.bincount(np.flatnonzero(bad) // 27,minlength=count) > 0,
+             VARIABLES)
+
+    seas = np.bincount(np.flatnonzero(water.ravel() & roots) // nodes,
+                       minlength=count)
+    fail(seas > 1,DISCONNECTED)
+    return verdict
+
+def check(boards,maxvars=None):
+    """Return the verdict on each board, as a string of REASONS.
+    Boards are given as for parse, but can be of different sizes.
+    A board that cannot be parsed gets the error as its verdict."""
+    shapes = {}
+    for (k,b) in enumerate(boards):
+        rows = b.split() if isinstance(b,str) else b
+        shape = (len(rows),len(rows[0]) if rows else 0)
+        shapes.setdefault(shape,[]).append(k)
+    verdicts = [None]*len(boards)
+    for ks in shapes.values():
+        try:
+            codes = verify(*parse([boards[k] for k in ks]),maxvars=maxvars)
+        except ValueError:
+            if len(ks) == 1:
+                verdicts[ks[0]] = str(sys.exc_info()[1])
+                continue
+            # find the bad ones
+            for k in ks:
+                verdicts[k] = check([boards[k]],maxvars)[0]
+            continue
+        for (k,code) in zip(ks,codes):
+            verdicts[k] = REASONS[code]
+    return verdicts
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('infiles', nargs='*', type=argparse.FileType('r'),
+                        default=[sys.stdin])
+    parser.add_argument('-m', '--maxvars', type=int,
+                        help="Max size of variable islands.")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Only print the boards that break the rules.")
+    args = parser.parse_args()
+
+    names = []
+    boards = []
+    for f in args.infiles:
+        for (k,text) in enumerate(f.read().split('\n\n')):
+            if text.strip():
+                names.append('%s:%d' % (f.name,k+1))
+                boards.append(text)
+    verdicts = check(boards,args.maxvars)
+    for (name,v) in zip(names,verdicts):
+        if v != 'ok' or not args.quiet:
+            print name,v
+    bad = len([v for v in verdicts if v != 'ok'])
+    sys.stderr.write('%d of %d boards break the rules.\n' % (bad,len(boards)))
+    if bad:
+        sys.exit(1)